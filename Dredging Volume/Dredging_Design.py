@@ -1,126 +1,431 @@
+import math
+import os
+import sys
+import time
+from multiprocessing import Pool, shared_memory
 import geopandas as gpd
+import pandas as pd
 import rasterio
 from rasterio import features
 from rasterio.transform import rowcol
+from rasterio.windows import Window
 import numpy as np
 from scipy.ndimage import distance_transform_edt
-from tqdm import tqdm  
+from tqdm import tqdm
 from shapely.geometry import box
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import raster_io
+
 # File paths (update these paths if needed)
 geotiff_path = r'Dredging Level with buffer zone.tif'
 gpkg_path = r'With_buffer.gpkg'
 output_geotiff = r'output_new_geotiff_vh_corrected_position.tif'
+volume_report = r'dredging_volume_report.csv'  # Cut volume summary per polygon (.csv or .json)
 
 
 # Parameters for user to adjust
 vh_ratio = 3  # V:H ratio (e.g., 1:3 as 3)
 threshold_distance_meters = 20  # Set the maximum distance for V:H adjustment in meters
+design_mode = 'per_polygon'  # 'per_polygon' (one polygon at a time), 'single_pass' (all polygons in one label raster)
+                             # or 'tiled' (single pass over windows, for rasters larger than RAM)
+                             # or 'parallel' (polygons with non-overlapping buffers on a process pool)
+tile_size = 2048  # Tile edge in pixels for the 'tiled' mode; peak memory is set by the tile size plus its halo
+worker_count = os.cpu_count()  # Number of processes for the 'parallel' mode
+benchmark_parallel = False  # Also run the 'parallel' schedule serially and report the speedup
+
 
-# Load GPKG data
-gpkg_data = gpd.read_file(gpkg_path)
+# Vectorized slope engine: adjust all depths from the polygon boundary outward in one array pass
+def apply_side_slope(adjusted_block, geotiff_block, flat_block, distance_to_boundary, boundary_depth,
+                     vh_ratio, max_distance):
+    # Only pixels outside the polygons and within the maximum V:H distance are adjusted
+    slope_zone = np.isnan(flat_block) & (distance_to_boundary <= max_distance)
+    # The boundary depth is either one polygon's depth or a per-pixel array of governing depths
+    if np.ndim(boundary_depth):
+        boundary_depth = boundary_depth[slope_zone]
+    new_depth = boundary_depth + distance_to_boundary[slope_zone] / vh_ratio
+    # Ensure the depth does not become shallower than the GeoTIFF value
+    adjusted_block[slope_zone] = np.minimum(new_depth, geotiff_block[slope_zone])
+    return slope_zone
 
-# Load GeoTIFF data
-with rasterio.open(geotiff_path) as src:
-    geotiff_data = src.read(1)  # Read first band
-    geotiff_transform = src.transform
-    geotiff_profile = src.profile
-    geotiff_bounds = src.bounds  # Get GeoTIFF bounds
-    geotiff_resolution = src.res[0]  # Get resolution (meters per pixel)
 
-# Convert threshold distance from meters to pixels
-threshold_distance_pixels = threshold_distance_meters / geotiff_resolution
+# Process each polygon on its own bounding box; overlapping buffers are resolved by the last polygon
+def design_per_polygon(gpkg_data, geotiff_data, geotiff_transform, geotiff_bounds, geotiff_resolution):
+    # Create a copy of the GeoTIFF data for adjusted depths
+    adjusted_surface = np.copy(geotiff_data)
 
-# Create a copy of the GeoTIFF data for adjusted depths
-adjusted_surface = np.copy(geotiff_data)
+    # Create an empty surface to store the polygon depth values
+    flat_surface = np.full(geotiff_data.shape, np.nan)
 
-# Create an empty surface to store the polygon depth values
-flat_surface = np.full(geotiff_data.shape, np.nan)
+    # 1-based position of the polygon that last set each pixel (0 = untouched), used for the volume report
+    design_labels = np.zeros(geotiff_data.shape, dtype=np.int32)
+
+    for position, (index, row) in enumerate(tqdm(gpkg_data.iterrows(), total=len(gpkg_data), desc="Dredging design", unit="polygon"), start=1):
+        polygon = row['geometry']
+        depth_value = row['Depth']
+
+        # Create a buffer to limit calculations, but not to calculate every point within the buffer
+        buffered_polygon = polygon.buffer(threshold_distance_meters)
+
+        # Clip the buffered polygon to GeoTIFF bounds to avoid unnecessary calculations
+        clipped_polygon = buffered_polygon.intersection(box(*geotiff_bounds))
+
+        if clipped_polygon.is_empty:
+            continue
+
+        # Calculate the bounding box of the clipped polygon to limit the calculation range
+        minx, miny, maxx, maxy = clipped_polygon.bounds
+
+        # Convert world coordinates to row/col
+        row_min, col_min = rowcol(geotiff_transform, minx, maxy)  # Top-left corner
+        row_max, col_max = rowcol(geotiff_transform, maxx, miny)  # Bottom-right corner
+
+        # Convert to integers
+        row_min, row_max = int(row_min), int(row_max)
+        col_min, col_max = int(col_min), int(col_max)
+
+        # Ensure valid dimensions for the sub-region
+        if row_min >= row_max or col_min >= col_max or row_min < 0 or col_min < 0:
+            print(f"Invalid bounding box for polygon at index {index}. Skipping this polygon.")
+            continue
+
+        # Check if the calculated shape is valid
+        block_shape = (row_max - row_min, col_max - col_min)
+        if block_shape[0] <= 0 or block_shape[1] <= 0:
+            print(f"Skipping polygon at index {index} due to invalid block shape.")
+            continue
+
+        # Extract the sub-region of the GeoTIFF and flat_surface for this polygon
+        flat_surface_block = flat_surface[row_min:row_max, col_min:col_max]
+        adjusted_surface_block = adjusted_surface[row_min:row_max, col_min:col_max]
+        geotiff_block = geotiff_data[row_min:row_max, col_min:col_max]
+        design_labels_block = design_labels[row_min:row_max, col_min:col_max]
+
+        # Define the transform for this sub-region
+        sub_transform = rasterio.transform.from_bounds(minx, miny, maxx, maxy, block_shape[1], block_shape[0])
+
+        # Create mask for the original polygon to define the true boundary
+        polygon_mask = features.geometry_mask([polygon], out_shape=block_shape, transform=sub_transform, invert=True)
+
+        # Debug information: Check the mask and block shape
+        print(f"Index {index}: polygon_mask shape: {polygon_mask.shape}, flat_surface_block shape: {flat_surface_block.shape}")
+
+        # Ensure the mask has the correct shape before applying
+        if polygon_mask.shape != flat_surface_block.shape:
+            print(f"Shape mismatch at index {index}: polygon_mask shape {polygon_mask.shape}, flat_surface_block shape {flat_surface_block.shape}")
+            continue
+
+        # Assign depth values inside the original polygon
+        flat_surface_block[polygon_mask] = depth_value
+        adjusted_surface_block[polygon_mask] = np.minimum(geotiff_block[polygon_mask], depth_value)  # Nodata (NaN) stays nodata
+
+        # Calculate distance from the original polygon boundary outward, limited to the buffer area
+        distance_to_boundary = distance_transform_edt(~polygon_mask) * geotiff_resolution
+
+        # Adjust depths based on distance and V:H ratio, limited to the buffer area
+        slope_zone = apply_side_slope(adjusted_surface_block, geotiff_block, flat_surface_block, distance_to_boundary,
+                                      depth_value, vh_ratio, threshold_distance_meters)
+        design_labels_block[polygon_mask | slope_zone] = position
+
+    return adjusted_surface, flat_surface, design_labels
+
+
+# Process all polygons at once: one label raster, one EDT, and the nearest polygon governs each slope pixel
+def design_single_pass(polygons, depths, geotiff_block, block_transform, resolution):
+    # Rasterize every polygon with its 1-based feature ID (0 = outside all polygons)
+    labels = features.rasterize(((polygon, label) for label, polygon in enumerate(polygons, start=1)),
+                                out_shape=geotiff_block.shape, transform=block_transform, fill=0, dtype='int32')
+    polygon_mask = labels > 0
+
+    adjusted_block = np.copy(geotiff_block)
+    flat_block = np.full(geotiff_block.shape, np.nan)
+    if not polygon_mask.any():
+        return adjusted_block, flat_block, labels
+
+    # Depth lookup by feature ID, index 0 is the background
+    depth_lookup = np.concatenate(([np.nan], np.asarray(depths, dtype=float)))
+
+    # Assign depth values inside the polygons
+    flat_block[polygon_mask] = depth_lookup[labels[polygon_mask]]
+    adjusted_block[polygon_mask] = np.minimum(geotiff_block[polygon_mask], flat_block[polygon_mask])
+
+    # Distance to the nearest polygon pixel and the indices of that pixel
+    distance_to_boundary, (nearest_y, nearest_x) = distance_transform_edt(~polygon_mask, return_indices=True)
+    distance_to_boundary *= resolution
+
+    # Governing depth of every pixel is the depth of its nearest polygon
+    design_labels = labels[nearest_y, nearest_x]
+    del nearest_y, nearest_x
+    governing_depth = depth_lookup[design_labels]
+
+    slope_zone = apply_side_slope(adjusted_block, geotiff_block, flat_block, distance_to_boundary,
+                                  governing_depth, vh_ratio, threshold_distance_meters)
+    # Keep the governing polygon only where the design changed the surface, used for the volume report
+    design_labels[~(polygon_mask | slope_zone)] = 0
+    return adjusted_block, flat_block, design_labels
+
+
+# Stream the single-pass design over windows with a halo, so the raster never has to fit in memory
+def design_tiled(gpkg_data, src, dst, tile_size, cut_report):
+    geotiff_resolution = src.res[0]
+    pixel_area = abs(src.transform.a * src.transform.e)
+    # The halo covers the whole V:H distance, so the nearest polygon of every tile pixel is inside the read window
+    halo = int(np.ceil(threshold_distance_meters / geotiff_resolution)) + 1
+    full_window = Window(0, 0, src.width, src.height)
+    spatial_index = gpkg_data.sindex
+
+    tiles = [Window(col_off, row_off, min(tile_size, src.width - col_off), min(tile_size, src.height - row_off))
+             for row_off in range(0, src.height, tile_size)
+             for col_off in range(0, src.width, tile_size)]
+
+    for tile in tqdm(tiles, desc="Dredging design", unit="tile"):
+        read_window = Window(tile.col_off - halo, tile.row_off - halo,
+                             tile.width + 2 * halo, tile.height + 2 * halo).intersection(full_window)
+        read_window = read_window.round_offsets().round_lengths()
+        read_transform = src.window_transform(read_window)
+
+        # Only the polygons touching the read window take part, in their original order
+        candidates = np.sort(spatial_index.query(box(*rasterio.windows.bounds(read_window, src.transform))))
+        tile_polygons = gpkg_data.iloc[candidates]
+
+        geotiff_block = raster_io.read_window(src, read_window)
+        adjusted_block, flat_block, design_labels = design_single_pass(tile_polygons.geometry, tile_polygons['Depth'],
+                                                                       geotiff_block, read_transform, geotiff_resolution)
+        # Map the tile-local feature IDs back to positions in the whole polygon set
+        design_labels = np.concatenate(([0], candidates + 1))[design_labels]
+
+        # Write back only the tile itself, the halo belongs to the neighbouring tiles
+        row_start = tile.row_off - read_window.row_off
+        col_start = tile.col_off - read_window.col_off
+        core = (slice(row_start, row_start + tile.height), slice(col_start, col_start + tile.width))
+        dst.write(raster_io.fill_nodata(adjusted_block[core], dst.nodata).astype(rasterio.float32), 1, window=tile)
+        accumulate_cut(cut_report, geotiff_block[core], adjusted_block[core], flat_block[core], design_labels[core],
+                       pixel_area)
+
+
+# Group polygons so that the buffered bounding boxes inside one group never overlap
+def group_polygons(gpkg_data, geotiff_transform, geotiff_shape, geotiff_bounds):
+    groups = []
+    group_windows = []
+    raster_box = box(*geotiff_bounds)
+
+    for position, (polygon, depth_value) in enumerate(zip(gpkg_data.geometry, gpkg_data['Depth']), start=1):
+        clipped_polygon = polygon.buffer(threshold_distance_meters).intersection(raster_box)
+        if clipped_polygon.is_empty:
+            continue
+
+        # Grid-aligned pixel window of the buffered polygon
+        minx, miny, maxx, maxy = clipped_polygon.bounds
+        row_min, col_min = rowcol(geotiff_transform, minx, maxy)
+        row_max, col_max = rowcol(geotiff_transform, maxx, miny, op=math.ceil)
+        row_min, col_min = max(int(row_min), 0), max(int(col_min), 0)
+        row_max, col_max = min(int(row_max), geotiff_shape[0]), min(int(col_max), geotiff_shape[1])
+        if row_min >= row_max or col_min >= col_max:
+            continue
+
+        window = np.array([row_min, row_max, col_min, col_max])
+        task = (position, polygon, depth_value, tuple(window))
+
+        # First group whose windows are all disjoint from this one
+        for group, windows in zip(groups, group_windows):
+            overlap = ((windows[:, 0] < row_max) & (row_min < windows[:, 1]) &
+                       (windows[:, 2] < col_max) & (col_min < windows[:, 3]))
+            if not overlap.any():
+                group.append(task)
+                windows.resize((len(windows) + 1, 4), refcheck=False)
+                windows[-1] = window
+                break
+        else:
+            groups.append([task])
+            group_windows.append(window[np.newaxis, :].copy())
+
+    return groups
+
+
+# Shared-memory views of the surfaces used by design_polygon_task, set up in every worker
+shared_surfaces = {}
+shared_memory_handles = []
+
+
+def create_shared_array(shape, dtype, fill_value):
+    shm = shared_memory.SharedMemory(create=True, size=int(np.prod(shape)) * np.dtype(dtype).itemsize)
+    array = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    array[...] = fill_value
+    return shm, array
+
+
+def attach_shared_surfaces(surface_specs, geotiff_transform, geotiff_resolution):
+    for name, (shm_name, shape, dtype) in surface_specs.items():
+        shm = shared_memory.SharedMemory(name=shm_name)
+        shared_memory_handles.append(shm)
+        shared_surfaces[name] = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    shared_surfaces['transform'] = geotiff_transform
+    shared_surfaces['resolution'] = geotiff_resolution
+
+
+# Rasterize, EDT and slope for one polygon, merged into the shared surfaces with min-depth semantics
+def design_polygon_task(task):
+    position, polygon, depth_value, (row_min, row_max, col_min, col_max) = task
+    block = (slice(row_min, row_max), slice(col_min, col_max))
+    geotiff_block = shared_surfaces['geotiff'][block]
+    block_transform = rasterio.windows.transform(Window(col_min, row_min, col_max - col_min, row_max - row_min),
+                                                 shared_surfaces['transform'])
+
+    polygon_mask = features.geometry_mask([polygon], out_shape=geotiff_block.shape, transform=block_transform,
+                                          invert=True)
+    if not polygon_mask.any():
+        return
+
+    # Design surface of this polygon alone
+    candidate_block = np.copy(geotiff_block)
+    candidate_block[polygon_mask] = np.minimum(geotiff_block[polygon_mask], depth_value)
+    polygon_flat_block = np.where(polygon_mask, depth_value, np.nan)
+    distance_to_boundary = distance_transform_edt(~polygon_mask) * shared_surfaces['resolution']
+    slope_zone = apply_side_slope(candidate_block, geotiff_block, polygon_flat_block, distance_to_boundary,
+                                  depth_value, vh_ratio, threshold_distance_meters)
+
+    # Keep the deeper surface, so the merge does not depend on the processing order
+    adjusted_block = shared_surfaces['adjusted'][block]
+    improved = (polygon_mask | slope_zone) & (candidate_block <= adjusted_block)
+    adjusted_block[improved] = candidate_block[improved]
+    shared_surfaces['labels'][block][improved] = position
+    flat_block = shared_surfaces['flat'][block]
+    flat_block[polygon_mask] = np.fmin(flat_block[polygon_mask], depth_value)
+
+
+# Process polygon groups one after another, the polygons of a group in parallel on shared-memory surfaces
+def design_parallel(gpkg_data, geotiff_data, geotiff_transform, geotiff_bounds, geotiff_resolution, workers):
+    groups = group_polygons(gpkg_data, geotiff_transform, geotiff_data.shape, geotiff_bounds)
+    print(f"{sum(len(group) for group in groups)} polygons scheduled in {len(groups)} non-overlapping groups.")
+
+    handles = []
+    surface_specs = {}
+    try:
+        for name, dtype, fill_value in (('geotiff', np.float64, geotiff_data), ('adjusted', np.float64, geotiff_data),
+                                        ('flat', np.float64, np.nan), ('labels', np.int32, 0)):
+            shm, _ = create_shared_array(geotiff_data.shape, dtype, fill_value)
+            handles.append(shm)
+            surface_specs[name] = (shm.name, geotiff_data.shape, dtype)
+
+        if workers > 1:
+            with Pool(processes=workers, initializer=attach_shared_surfaces,
+                      initargs=(surface_specs, geotiff_transform, geotiff_resolution)) as pool:
+                for group in tqdm(groups, desc="Dredging design", unit="group"):
+                    pool.map(design_polygon_task, group, chunksize=max(1, len(group) // (workers * 4)))
+        else:
+            attach_shared_surfaces(surface_specs, geotiff_transform, geotiff_resolution)
+            for group in tqdm(groups, desc="Dredging design", unit="group"):
+                for task in group:
+                    design_polygon_task(task)
+
+        adjusted_surface = np.ndarray(geotiff_data.shape, np.float64, buffer=handles[1].buf).copy()
+        flat_surface = np.ndarray(geotiff_data.shape, np.float64, buffer=handles[2].buf).copy()
+        design_labels = np.ndarray(geotiff_data.shape, np.int32, buffer=handles[3].buf).copy()
+    finally:
+        shared_surfaces.clear()
+        while shared_memory_handles:
+            shared_memory_handles.pop().close()
+        for shm in handles:
+            shm.close()
+            shm.unlink()
+
+    return adjusted_surface, flat_surface, design_labels
 
-# Function to adjust depths starting from the polygon boundary outward
-def adjust_depth_from_boundary(y, x, flat_surface, geotiff_data, distance_to_boundary, vh_ratio, boundary_depth):
-    delta_z = distance_to_boundary[y, x] / vh_ratio
-    new_depth = boundary_depth + delta_z
-    # Ensure the depth does not become shallower than the GeoTIFF value
-    return min(new_depth, geotiff_data[y, x])
 
-# Process each polygon
-for index, row in gpkg_data.iterrows():
-    polygon = row['geometry']
-    depth_value = row['Depth']
+# Cut volume, area and max cut per polygon, split into the polygon itself and its side-slope zone
+def new_cut_report(polygon_count):
+    return {zone: {'volume': np.zeros(polygon_count + 1), 'area': np.zeros(polygon_count + 1),
+                   'max_cut': np.zeros(polygon_count + 1)}
+            for zone in ('polygon', 'slope')}
 
-    # Create a buffer to limit calculations, but not to calculate every point within the buffer
-    buffered_polygon = polygon.buffer(threshold_distance_meters)
 
-    # Clip the buffered polygon to GeoTIFF bounds to avoid unnecessary calculations
-    clipped_polygon = buffered_polygon.intersection(box(*geotiff_bounds))
+# Accumulate the report with vectorized reductions over the design masks of one block
+def accumulate_cut(cut_report, geotiff_block, adjusted_block, flat_block, design_labels, pixel_area):
+    # Surfaces are elevations, so the cut is the existing seabed minus the design surface
+    cut = geotiff_block - adjusted_block
+    dredged = (design_labels > 0) & (cut > 0)
+    inside = ~np.isnan(flat_block)
+    minlength = len(cut_report['polygon']['volume'])
 
-    if clipped_polygon.is_empty:
-        continue
+    for zone, zone_mask in (('polygon', dredged & inside), ('slope', dredged & ~inside)):
+        zone_labels = design_labels[zone_mask]
+        zone_cut = cut[zone_mask]
+        cut_report[zone]['volume'] += np.bincount(zone_labels, weights=zone_cut, minlength=minlength) * pixel_area
+        cut_report[zone]['area'] += np.bincount(zone_labels, minlength=minlength) * pixel_area
+        np.maximum.at(cut_report[zone]['max_cut'], zone_labels, zone_cut)
 
-    # Calculate the bounding box of the clipped polygon to limit the calculation range
-    minx, miny, maxx, maxy = clipped_polygon.bounds
 
-    # Use the 'src.index' method to convert world coordinates (lon/lat) to row/col
-    row_min, col_min = src.index(minx, maxy)  # Top-left corner
-    row_max, col_max = src.index(maxx, miny)  # Bottom-right corner
+def write_cut_report(cut_report, gpkg_data, report_path):
+    report_df = pd.DataFrame({'Polygon': gpkg_data.index, 'Depth': gpkg_data['Depth'].to_numpy()})
+    for zone in ('polygon', 'slope'):
+        report_df[f'{zone}_cut_volume'] = cut_report[zone]['volume'][1:]
+        report_df[f'{zone}_cut_area'] = cut_report[zone]['area'][1:]
+        report_df[f'{zone}_max_cut'] = cut_report[zone]['max_cut'][1:]
+    report_df['total_cut_volume'] = report_df['polygon_cut_volume'] + report_df['slope_cut_volume']
 
-    # Convert to integers
-    row_min, row_max = int(row_min), int(row_max)
-    col_min, col_max = int(col_min), int(col_max)
+    if report_path.lower().endswith('.json'):
+        report_df.to_json(report_path, orient='records', indent=2)
+    else:
+        report_df.to_csv(report_path, index=False)
 
-    # Ensure valid dimensions for the sub-region
-    if row_min >= row_max or col_min >= col_max or row_min < 0 or col_min < 0:
-        print(f"Invalid bounding box for polygon at index {index}. Skipping this polygon.")
-        continue
+    print(f"Total cut volume: {report_df['total_cut_volume'].sum():.1f} m3 "
+          f"(polygons {report_df['polygon_cut_volume'].sum():.1f} m3, "
+          f"side slopes {report_df['slope_cut_volume'].sum():.1f} m3)")
 
-    # Check if the calculated shape is valid
-    block_shape = (row_max - row_min, col_max - col_min)
-    if block_shape[0] <= 0 or block_shape[1] <= 0:
-        print(f"Skipping polygon at index {index} due to invalid block shape.")
-        continue
 
-    # Extract the sub-region of the GeoTIFF and flat_surface for this polygon
-    flat_surface_block = flat_surface[row_min:row_max, col_min:col_max]
-    adjusted_surface_block = adjusted_surface[row_min:row_max, col_min:col_max]
-    geotiff_block = geotiff_data[row_min:row_max, col_min:col_max]
+if __name__ == "__main__":
+    # Load GPKG data
+    gpkg_data = gpd.read_file(gpkg_path)
+    cut_report = new_cut_report(len(gpkg_data))
 
-    # Define the transform for this sub-region
-    sub_transform = rasterio.transform.from_bounds(minx, miny, maxx, maxy, block_shape[1], block_shape[0])
+    if design_mode == 'tiled':
+        with rasterio.open(geotiff_path) as src:
+            # Tiled, compressed output so the result can be streamed window by window
+            geotiff_profile = src.profile
+            geotiff_profile.update(dtype=rasterio.float32, count=1, compress='lzw', tiled=True,
+                                   blockxsize=256, blockysize=256, BIGTIFF='IF_SAFER')
 
-    # Create mask for the original polygon to define the true boundary
-    polygon_mask = features.geometry_mask([polygon], out_shape=block_shape, transform=sub_transform, invert=True)
+            with rasterio.open(output_geotiff, 'w', **geotiff_profile) as dst:
+                design_tiled(gpkg_data, src, dst, tile_size, cut_report)
 
-    # Debug information: Check the mask and block shape
-    print(f"Index {index}: polygon_mask shape: {polygon_mask.shape}, flat_surface_block shape: {flat_surface_block.shape}")
+    else:
+        # Load GeoTIFF data
+        with rasterio.open(geotiff_path) as src:
+            geotiff_data = raster_io.read_band(src)  # First band as float64, nodata as NaN
+            geotiff_transform = src.transform
+            geotiff_profile = src.profile
+            geotiff_bounds = src.bounds  # Get GeoTIFF bounds
+            geotiff_resolution = src.res[0]  # Get resolution (meters per pixel)
 
-    # Ensure the mask has the correct shape before applying
-    if polygon_mask.shape != flat_surface_block.shape:
-        print(f"Shape mismatch at index {index}: polygon_mask shape {polygon_mask.shape}, flat_surface_block shape {flat_surface_block.shape}")
-        continue
+        if design_mode == 'single_pass':
+            adjusted_surface, flat_surface, design_labels = design_single_pass(
+                gpkg_data.geometry, gpkg_data['Depth'], geotiff_data, geotiff_transform, geotiff_resolution)
+        elif design_mode == 'parallel':
+            start_time = time.perf_counter()
+            adjusted_surface, flat_surface, design_labels = design_parallel(
+                gpkg_data, geotiff_data, geotiff_transform, geotiff_bounds, geotiff_resolution, worker_count)
+            parallel_time = time.perf_counter() - start_time
+            print(f"Parallel design with {worker_count} workers: {parallel_time:.2f} s")
 
-    # Assign depth values inside the original polygon
-    flat_surface_block[polygon_mask] = depth_value
-    adjusted_surface_block[polygon_mask] = np.where(geotiff_block[polygon_mask] < depth_value,
-                                                    geotiff_block[polygon_mask], depth_value)
+            if benchmark_parallel:
+                start_time = time.perf_counter()
+                design_parallel(gpkg_data, geotiff_data, geotiff_transform, geotiff_bounds, geotiff_resolution, 1)
+                serial_time = time.perf_counter() - start_time
+                print(f"Serial design: {serial_time:.2f} s, speedup {serial_time / parallel_time:.2f}x")
+        else:
+            adjusted_surface, flat_surface, design_labels = design_per_polygon(
+                gpkg_data, geotiff_data, geotiff_transform, geotiff_bounds, geotiff_resolution)
 
-    # Calculate distance from the original polygon boundary outward, limited to the buffer area
-    distance_to_boundary = distance_transform_edt(~polygon_mask) * geotiff_resolution
+        accumulate_cut(cut_report, geotiff_data, adjusted_surface, flat_surface, design_labels,
+                       abs(geotiff_transform.a * geotiff_transform.e))
 
-    # Initialize progress bar
-    with tqdm(total=np.count_nonzero(polygon_mask), desc="Optimized depth calculation", unit="pixel") as pbar:
-        # Adjust depths based on distance and V:H ratio, limited to the bounding box and within the buffer area
-        for y in range(row_max - row_min):
-            for x in range(col_max - col_min):
-                if np.isnan(flat_surface_block[y, x]) and distance_to_boundary[y, x] <= threshold_distance_pixels:
-                    adjusted_surface_block[y, x] = adjust_depth_from_boundary(y, x, flat_surface_block, geotiff_block,
-                                                                              distance_to_boundary, vh_ratio, depth_value)
-                pbar.update(1)
+        # Save the adjusted GeoTIFF
+        geotiff_profile.update(dtype=rasterio.float32, count=1, compress='lzw')
 
-# Save the adjusted GeoTIFF
-geotiff_profile.update(dtype=rasterio.float32, count=1, compress='lzw')
+        with rasterio.open(output_geotiff, 'w', **geotiff_profile) as dst:
+            dst.write(raster_io.fill_nodata(adjusted_surface, geotiff_profile['nodata']).astype(rasterio.float32), 1)
 
-with rasterio.open(output_geotiff, 'w', **geotiff_profile) as dst:
-    dst.write(adjusted_surface.astype(rasterio.float32), 1)
+    print(f"New GeoTIFF file saved at: {output_geotiff}")
 
-print(f"New GeoTIFF file saved at: {output_geotiff}")
+    write_cut_report(cut_report, gpkg_data, volume_report)
+    print(f"Volume report saved at: {volume_report}")
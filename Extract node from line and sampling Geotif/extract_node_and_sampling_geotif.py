@@ -1,232 +1,344 @@
 import geopandas as gpd
 import pandas as pd
-from shapely.geometry import Point
-from math import sqrt
 import os
+import sys
+import argparse
+import glob
+import json
+from multiprocessing import Pool
 from pyproj import Transformer
 import rasterio
 import numpy as np
 
-def display_fields_and_samples(gdf):
-    if gdf.empty:
-        print("Error: The input GeoDataFrame is empty. Please check the input file.")
-        return False
-
-    print("\nAvailable columns:")
-    for col in gdf.columns:
-        print(f" - {col}")
-    
-    print("\nFirst 10 rows of data:")
-    print(gdf.head(10))
-    return True
-
-def sample_elevation(point, src_array, transform, search_radius, nodata_value):
-    if src_array is None or transform is None:
-        return None
-
-    px, py = ~transform * (point.x, point.y)
-    px, py = int(px), int(py)
-
-    if 0 <= px < src_array.shape[1] and 0 <= py < src_array.shape[0]:
-        value = src_array[py, px]
-        if value != nodata_value and value != -9999 and not np.isnan(value):
-            return value
-    return None
-
-def process_line_data(file_path, geotiff_path):
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import raster_io
+
+SUPPORTED_EXTENSIONS = [".gpkg", ".geojson", ".shp"]
+
+worker = {}
+
+def sample_elevation(x, y, src, search_radius, method='nearest'):
+    if src is None:
+        return np.full(len(x), np.nan)
+
+    x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+    col, row = ~src.transform * (x, y)
+
+    if method == 'bilinear':
+        # Weights of the four surrounding cell centres, renormalised over the ones that hold data
+        col, row = col - 0.5, row - 0.5
+        col0, row0 = np.floor(col).astype(np.int64), np.floor(row).astype(np.int64)
+        fc, fr = col - col0, row - row0
+        total = np.zeros(len(x))
+        weight = np.zeros(len(x))
+        for dr, dc, w in ((0, 0, (1 - fr) * (1 - fc)), (0, 1, (1 - fr) * fc), (1, 0, fr * (1 - fc)), (1, 1, fr * fc)):
+            value = raster_io.read_cells(src, row0 + dr, col0 + dc)
+            valid = ~np.isnan(value)
+            total[valid] += value[valid] * w[valid]
+            weight[valid] += w[valid]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            elevation = np.where(weight > 0, total / weight, np.nan)
+    else:
+        elevation = raster_io.read_cells(src, np.floor(row).astype(np.int64), np.floor(col).astype(np.int64))
+
+    # Nodata points take the closest valid cell centre within search_radius
+    missing = np.flatnonzero(np.isnan(elevation))
+    if search_radius > 0 and len(missing):
+        reach_col = int(np.ceil(search_radius / abs(src.transform.a)))
+        reach_row = int(np.ceil(search_radius / abs(src.transform.e)))
+        offset_row, offset_col = np.mgrid[-reach_row:reach_row + 1, -reach_col:reach_col + 1]
+        offset_row, offset_col = offset_row.ravel(), offset_col.ravel()
+        chunk = max(1, 1000000 // len(offset_row))
+        for start in range(0, len(missing), chunk):
+            points = missing[start:start + chunk]
+            rows = (np.floor(row[points]).astype(np.int64)[:, np.newaxis] + offset_row).ravel()
+            cols = (np.floor(col[points]).astype(np.int64)[:, np.newaxis] + offset_col).ravel()
+            values = raster_io.read_cells(src, rows, cols).reshape(len(points), -1)
+            cell_x, cell_y = src.transform * (cols + 0.5, rows + 0.5)
+            distance = np.hypot(cell_x.reshape(len(points), -1) - x[points, np.newaxis],
+                                cell_y.reshape(len(points), -1) - y[points, np.newaxis])
+            distance[np.isnan(values) | (distance > search_radius)] = np.inf
+            nearest = np.argmin(distance, axis=1)
+            found = np.isfinite(distance[np.arange(len(points)), nearest])
+            elevation[points[found]] = values[np.arange(len(points)), nearest][found]
+
+    return elevation.astype(np.result_type(np.float32, src.dtypes[0]))
+
+def line_parts(line):
+    if line.geom_type == 'LineString':
+        return [np.asarray(line.coords)[:, :2]]
+    elif line.geom_type == 'MultiLineString':
+        return [np.asarray(linestring.coords)[:, :2] for linestring in line.geoms]
+    return []
+
+def densify_line(line, fixed_distance, include_original_nodes):
+    parts = [coords for coords in line_parts(line) if len(coords) > 0]
+    if not parts:
+        return np.empty(0), np.empty(0), np.empty(0)
+
+    # Cumulative vertex chainage; parts of a MultiLineString follow each other without the gap between them
+    vertices = []
+    vertex_kp = []
+    segment_start = []
+    segment_end = []
+    segment_kp = []
+    offset = 0.0
+    for coords in parts:
+        steps = np.hypot(*np.diff(coords, axis=0).T)
+        chainage = offset + np.concatenate(([0.0], np.cumsum(steps)))
+        vertices.append(coords)
+        vertex_kp.append(chainage)
+        segment_start.append(coords[:-1])
+        segment_end.append(coords[1:])
+        segment_kp.append(chainage)
+        offset = chainage[-1]
+
+    vertices = np.concatenate(vertices)
+    vertex_kp = np.concatenate(vertex_kp)
+    length = offset
+
+    if fixed_distance == 0:
+        easting, northing, kp = vertices[:, 0], vertices[:, 1], vertex_kp
+    else:
+        # All spacing points at once, plus the end point when the last spacing point falls short of it
+        kp = np.arange(int(np.floor(length / fixed_distance)) + 1) * fixed_distance
+        kp = kp[kp <= length]
+        if kp[-1] < length:
+            kp = np.append(kp, length)
+
+        # Locate each spacing point on its segment with searchsorted and interpolate linearly
+        starts = np.concatenate(segment_start)
+        ends = np.concatenate(segment_end)
+        start_kp = np.concatenate([chainage[:-1] for chainage in segment_kp])
+        end_kp = np.concatenate([chainage[1:] for chainage in segment_kp])
+        if len(starts) == 0:
+            starts, ends, start_kp, end_kp = vertices[:1], vertices[:1], vertex_kp[:1], vertex_kp[:1]
+        segment = np.minimum(np.searchsorted(end_kp, kp, side='left'), len(end_kp) - 1)
+        segment_length = end_kp[segment] - start_kp[segment]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratio = np.where(segment_length > 0, (kp - start_kp[segment]) / segment_length, 0.0)
+        points = starts[segment] + (ends[segment] - starts[segment]) * ratio[:, np.newaxis]
+        easting, northing = points[:, 0], points[:, 1]
+
+        if include_original_nodes:
+            easting = np.concatenate((easting, vertices[:, 0]))
+            northing = np.concatenate((northing, vertices[:, 1]))
+            kp = np.concatenate((kp, vertex_kp))
+
+    # Merge by chainage and drop exact duplicates (e.g. a vertex that is also a spacing point)
+    order = np.argsort(kp, kind='stable')
+    easting, northing, kp = easting[order], northing[order], kp[order]
+    keep = np.ones(len(kp), dtype=bool)
+    keep[1:] = (np.diff(kp) != 0) | (np.diff(easting) != 0) | (np.diff(northing) != 0)
+    return easting[keep], northing[keep], kp[keep]
+
+def init_worker(geotiff_path, sampling_method):
+    # Every worker opens its own handle on the GeoTIFF; blocks are cached per process by raster_io
+    worker['src'] = rasterio.open(geotiff_path) if geotiff_path else None
+    worker['sampling_method'] = sampling_method
+    worker['transformers'] = {}
+
+def read_line_data(file_path, field_name):
     try:
         gdf = gpd.read_file(file_path)
     except Exception as e:
-        print(f"Error reading the input file: {e}")
-        return
-
-    if gdf.crs is None:
-        print("CRS is missing in the input GIS file.")
-        gdf.set_crs("EPSG:3826", inplace=True)
-        print("Manually set CRS to EPSG:3826.")
-    else:
-        print(f"Input file CRS: {gdf.crs}")
-
-    if not display_fields_and_samples(gdf):
-        return
+        print(f"Error reading {file_path}: {e}")
+        return None, None
 
-    output_directory = "output_files_with_nodes_and_crs"
-    os.makedirs(output_directory, exist_ok=True)
+    if gdf.empty:
+        print(f"Error: {file_path} is empty. Please check the input file.")
+        return None, None
 
-    fixed_distance = float(input("Enter the spacing distance (0 for original nodes only): "))
-    include_original_nodes = True if fixed_distance == 0 else input("Include original nodes? (yes/no): ").strip().lower() == 'yes'
-    retain_attributes = input("Retain original line attributes? (yes/no): ").strip().lower() == 'yes'
-    export_shapefile = input("Export Shapefile? (yes/no): ").strip().lower() == 'yes'
+    if gdf.crs is None:
+        print(f"CRS is missing in {file_path}. Manually set CRS to {raster_io.DEFAULT_CRS}.")
+        gdf.set_crs(raster_io.DEFAULT_CRS, inplace=True)
 
-    field_name = input("Classify the segment line naming: ")
     if field_name not in gdf.columns:
-        print(f"Column '{field_name}' does not exist. Using sequential naming instead.")
+        if field_name:
+            print(f"Column '{field_name}' does not exist in {file_path}. Using sequential naming instead.")
         gdf['segment_name'] = gdf.index.to_series().astype(str)
         field_name = 'segment_name'
+    return gdf, field_name
+
+def process_segment(task):
+    file_path, segment_gdf, field_name, unique_value, options, output_directory = task
+    fixed_distance = options['fixed_distance']
+    include_original_nodes = options['include_original_nodes']
+    src = worker['src']
+    use_geotiff = src is not None
+
+    crs = segment_gdf.crs
+    if crs.to_wkt() not in worker['transformers']:
+        worker['transformers'][crs.to_wkt()] = Transformer.from_crs(crs, "EPSG:4326", always_xy=True)
+    transformer_to_4326 = worker['transformers'][crs.to_wkt()]
+
+    # Densify every line of the segment, then treat the segment as one set of columns
+    lines = [densify_line(line, fixed_distance, include_original_nodes) for line in segment_gdf.geometry]
+    counts = np.array([len(kp) for _, _, kp in lines])
+    if counts.sum() == 0:
+        return None
+
+    easting = np.concatenate([line[0] for line in lines])
+    northing = np.concatenate([line[1] for line in lines])
+    kp = np.concatenate([line[2] for line in lines])
+    line_index = np.repeat(np.arange(len(lines)), counts)
+    line_end = np.cumsum(counts)[counts > 0] - 1
+    line_start = np.zeros(len(kp), dtype=bool)
+    line_start[line_end - counts[counts > 0] + 1] = True
+
+    longitude, latitude = transformer_to_4326.transform(easting, northing)
+    elevation = sample_elevation(easting, northing, src, fixed_distance * 2, worker['sampling_method'])
+    valid = ~np.isnan(elevation)
+
+    # Steps between consecutive nodes; the first node of each line has no step
+    dx = np.diff(easting)
+    dy = np.diff(northing)
+    step = ~line_start[1:]
+    distance_meters = np.full(len(kp), np.nan)
+    distance_meters[1:] = np.where(step, np.round(np.sqrt(dx ** 2 + dy ** 2), 3), np.nan)
+
+    # Azimuth of the step arriving at each node; the first node of a line takes the azimuth of the second
+    azimuth = np.full(len(kp), np.nan)
+    with np.errstate(invalid='ignore'):
+        azimuth[1:] = np.where(step & ((dx != 0) | (dy != 0)), (np.degrees(np.arctan2(dx, dy)) + 360) % 360, np.nan)
+    first = np.flatnonzero(line_start)
+    first = first[first + 1 < len(kp)]
+    first = first[~line_start[first + 1]]
+    azimuth[first] = azimuth[first + 1]
+
+    dz = np.diff(elevation).astype(np.float64)
+    step_3d = step & valid[1:] & valid[:-1]
+    total_2d_length = np.cumsum(np.concatenate(([0], distance_meters[1:][step])))[-1]
+    running_3d = np.cumsum(np.concatenate(([0], np.where(step_3d, np.sqrt(distance_meters[1:] ** 2 + dz ** 2), 0))))
+    total_3d_length = running_3d[-1] if step_3d.any() else 0
+
+    length_3d = np.full(len(kp), np.nan)
+    length_3d[1:] = np.where(step & valid[1:] & ~np.isnan(azimuth[1:]),
+                             np.sqrt(distance_meters[1:] ** 2 + np.where(valid[:-1], dz, 0) ** 2), np.nan)
+
+    nodes_df = pd.DataFrame({
+        "Longitude": longitude,
+        "Latitude": latitude,
+        "Easting": easting,
+        "Northing": northing,
+        "Elevation": elevation,
+        "Distance": distance_meters,
+        "Length_3D": length_3d,
+        "Azimuth": np.round(azimuth, 3),
+        "KP": np.round(kp, 3),
+        # Running 3D total at the end of each node's line
+        "Total_3D_Length": np.where(valid, np.repeat(running_3d[line_end], counts[counts > 0]), np.nan),
+        field_name: unique_value
+    })
+
+    if options['retain_attributes']:
+        # One row per node from the line table, joined column-wise
+        attributes = pd.DataFrame(segment_gdf.drop(columns=[col for col in nodes_df.columns if col in segment_gdf.columns]))
+        nodes_df = pd.concat([nodes_df, attributes.iloc[line_index].reset_index(drop=True)], axis=1)
+    csv_file = os.path.join(output_directory, f"{unique_value}_KP.csv")
+    nodes_df.to_csv(csv_file, index=False)
+
+    shp_file = None
+    if options['export_shapefile']:
+        gdf_output = gpd.GeoDataFrame(nodes_df, geometry=gpd.points_from_xy(nodes_df["Easting"], nodes_df["Northing"]), crs=crs)
+        shp_file = os.path.join(output_directory, f"{unique_value}_KP.shp")
+        gdf_output.to_file(shp_file, driver="ESRI Shapefile")
+
+    return {
+        "Input": file_path,
+        "Segment": unique_value,
+        "Total 2D Distance": total_2d_length,
+        "Total 3D Distance": total_3d_length if use_geotiff else None,
+        "Output CSV": csv_file,
+        "Output Shapefile": shp_file
+    }
+
+def segment_tasks(file_path, options, output_directory):
+    gdf, field_name = read_line_data(file_path, options['field_name'])
+    if gdf is None:
+        return []
 
-    use_geotiff = bool(geotiff_path)
-    if use_geotiff:
-        with rasterio.open(geotiff_path) as src:
-            geotiff_array = src.read(1)
-            transform = src.transform
-            nodata_value = src.nodata
+    os.makedirs(output_directory, exist_ok=True)
+    # One pass over the table; groups come out in order of first appearance
+    return [(file_path, segment_gdf, field_name, unique_value, options, output_directory)
+            for unique_value, segment_gdf in gdf.groupby(field_name, sort=False)]
+
+def process_line_data(file_paths, geotiff_path, options, output_directory, sampling_method='nearest', workers=1):
+    # Segments of every input file go through one pool; each task writes its own outputs
+    tasks = []
+    for file_path in file_paths:
+        file_output = output_directory
+        if len(file_paths) > 1:
+            file_output = os.path.join(output_directory, os.path.splitext(os.path.basename(file_path))[0])
+        tasks.extend(segment_tasks(file_path, options, file_output))
+
+    if workers > 1 and len(tasks) > 1:
+        with Pool(processes=min(workers, len(tasks)), initializer=init_worker, initargs=(geotiff_path, sampling_method)) as pool:
+            report_data = pool.map(process_segment, tasks, chunksize=1)
     else:
-        geotiff_array, transform, nodata_value = None, None, None
-
-    transformer_to_4326 = Transformer.from_crs(gdf.crs, "EPSG:4326", always_xy=True)
-    segment_count = 0
-    report_data = []
-
-    for unique_value in gdf[field_name].unique():
-        segment_gdf = gdf[gdf[field_name] == unique_value]
-        nodes_data = []
-        geometry_data = []
-
-        total_2d_length = 0
-        total_3d_length = 0
-
-        for _, row in segment_gdf.iterrows():
-            line = row.geometry
-            length = line.length
-            current_distance = 0
-
-            original_points = []
-            if line.geom_type == 'LineString':
-                original_points = list(line.coords)
-            elif line.geom_type == 'MultiLineString':
-                for linestring in line.geoms:
-                    original_points.extend(linestring.coords)
-
-            points = set()
-
-            if fixed_distance == 0:
-                for pt in original_points:
-                    point = Point(pt)
-                    distance_along_line = line.project(point)
-                    points.add((point, distance_along_line))
-            else:
-                while current_distance <= length:
-                    point = line.interpolate(current_distance)
-                    points.add((point, current_distance))
-                    current_distance += fixed_distance
-
-                if current_distance - fixed_distance < length:
-                    end_point = line.interpolate(length)
-                    points.add((end_point, length))
-
-                if include_original_nodes:
-                    for pt in original_points:
-                        point = Point(pt)
-                        distance_along_line = line.project(point)
-                        points.add((point, distance_along_line))
-
-            sorted_points = sorted(points, key=lambda x: x[1])
-            prev_point = None
-            azimuths = []
-
-            for i, (point, distance_along_line) in enumerate(sorted_points):
-                lon, lat = transformer_to_4326.transform(point.x, point.y)
-                elevation = sample_elevation(point, geotiff_array, transform, fixed_distance * 2, nodata_value) if use_geotiff else None
-
-                distance_meters = None
-                length_3d = None
-                azimuth = None
-
-                if prev_point:
-                    dx = point.x - sorted_points[i - 1][0].x
-                    dy = point.y - sorted_points[i - 1][0].y
-                    if dx != 0 or dy != 0:
-                        angle_rad = np.arctan2(dx, dy)
-                        azimuth = (np.degrees(angle_rad) + 360) % 360
-
-                    distance_meters = round(point.distance(sorted_points[i - 1][0]), 3)
-                    total_2d_length += distance_meters
-
-                    if use_geotiff and elevation is not None and prev_point[2] is not None:
-                        dz = elevation - prev_point[2]
-                        length_3d = sqrt(distance_meters ** 2 + dz ** 2)
-                        total_3d_length += length_3d
-
-                azimuths.append(azimuth)
-                prev_point = (lon, lat, elevation)
-
-            for i, (point, distance_along_line) in enumerate(sorted_points):
-                lon, lat = transformer_to_4326.transform(point.x, point.y)
-                elevation = sample_elevation(point, geotiff_array, transform, fixed_distance * 2, nodata_value) if use_geotiff else None
-                distance_meters = None
-                length_3d = None
-
-                if i == 0 and len(azimuths) > 1:
-                    azimuth_value = azimuths[1]
-                else:
-                    azimuth_value = azimuths[i]
-
-                if i > 0:
-                    distance_meters = round(point.distance(sorted_points[i - 1][0]), 3)
-                    if use_geotiff and elevation is not None and azimuth_value is not None:
-                        dz = elevation - sorted_points[i - 1][0].z if hasattr(sorted_points[i - 1][0], 'z') else 0
-                        length_3d = sqrt(distance_meters ** 2 + dz ** 2)
-
-                node_data = {
-                    "Longitude": lon,
-                    "Latitude": lat,
-                    "Easting": point.x,
-                    "Northing": point.y,
-                    "Elevation": elevation if use_geotiff else None,
-                    "Distance": distance_meters,
-                    "Length_3D": length_3d if (use_geotiff and elevation is not None) else None,
-                    "Azimuth": round(azimuth_value, 3) if azimuth_value is not None else None,
-                    "KP": round(distance_along_line, 3),
-                    "Total_3D_Length": total_3d_length if (use_geotiff and elevation is not None) else None,
-                    field_name: unique_value
-                }
-
-                if retain_attributes:
-                    for col in gdf.columns:
-                        if col not in node_data:
-                            node_data[col] = row[col]
-
-                nodes_data.append(node_data)
-                geometry_data.append(Point(point.x, point.y))
-
-        if nodes_data:
-            segment_count += 1
-            nodes_df = pd.DataFrame(nodes_data)
-            csv_file = os.path.join(output_directory, f"{unique_value}_KP.csv")
-            nodes_df.to_csv(csv_file, index=False)
-
-            if export_shapefile:
-                gdf_output = gpd.GeoDataFrame(nodes_df, geometry=geometry_data, crs=gdf.crs)
-                shp_file = os.path.join(output_directory, f"{unique_value}_KP.shp")
-                gdf_output.to_file(shp_file, driver="ESRI Shapefile")
-                print(f"Shapefile saved to: {shp_file} with EPSG: {gdf.crs.to_string()}")
-
-            report_data.append({
-                "Segment": unique_value,
-                "Total 2D Distance": total_2d_length,
-                "Total 3D Distance": total_3d_length if use_geotiff else None,
-                "Output CSV": csv_file,
-                "Output Shapefile": shp_file if export_shapefile else None
-            })
-
-    report_df = pd.DataFrame(report_data)
+        init_worker(geotiff_path, sampling_method)
+        report_data = [process_segment(task) for task in tasks]
+        if worker['src'] is not None:
+            worker['src'].close()
+
+    report_data = [report for report in report_data if report is not None]
+    os.makedirs(output_directory, exist_ok=True)
+    report_df = pd.DataFrame(report_data, columns=["Input", "Segment", "Total 2D Distance", "Total 3D Distance", "Output CSV", "Output Shapefile"])
     report_file = os.path.join(output_directory, "processing_report.csv")
     report_df.to_csv(report_file, index=False)
-
-    print(f"Complete. Total {segment_count} lines processed. Report saved to '{report_file}'.")
+    return report_df, report_file
+
+def find_input_files(patterns):
+    if not patterns:
+        patterns = ["*" + ext for ext in SUPPORTED_EXTENSIONS]
+
+    file_paths = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern))
+        if not matches:
+            print(f"No files match '{pattern}'.")
+        for file_path in matches:
+            if file_path.endswith(tuple(SUPPORTED_EXTENSIONS)) and file_path not in file_paths:
+                file_paths.append(file_path)
+    return file_paths
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Extract nodes along lines, sample their elevation from a GeoTIFF and write one KP table per segment.")
+    parser.add_argument("inputs", nargs="*", help="vector files or glob patterns (default: every .gpkg/.geojson/.shp in the current directory)")
+    parser.add_argument("--config", help="JSON file with default values for any of the options below, e.g. {\"spacing\": 10, \"geotiff\": \"dem.tif\"}")
+    parser.add_argument("--geotiff", default=None, help="GeoTIFF to sample elevations from")
+    parser.add_argument("--spacing", type=float, default=0, help="spacing distance (0 for original nodes only)")
+    parser.add_argument("--include-original-nodes", action="store_true", help="keep the original line vertices between the spacing points")
+    parser.add_argument("--retain-attributes", action="store_true", help="copy the line attributes to every node")
+    parser.add_argument("--shapefile", action="store_true", help="also export a Shapefile per segment")
+    parser.add_argument("--field", default=None, help="column naming the segments (default: sequential naming)")
+    parser.add_argument("--method", choices=["nearest", "bilinear"], default="nearest", help="elevation sampling method")
+    parser.add_argument("--output-dir", default="output_files_with_nodes_and_crs", help="output directory")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="number of worker processes")
+
+    # Values from the config file become the defaults, so command line options still win
+    args, _ = parser.parse_known_args()
+    if args.config:
+        with open(args.config) as f:
+            parser.set_defaults(**{key.replace("-", "_"): value for key, value in json.load(f).items()})
+    return parser.parse_args()
 
 def main():
-    directory = os.getcwd()
-    geotiff_path = input("Enter the path to the GeoTIFF file (or leave blank to skip): ").strip() or None
-
-    supported_extensions = [".gpkg", ".geojson", ".shp"]
-    for filename in os.listdir(directory):
-        if any(filename.endswith(ext) for ext in supported_extensions):
-            file_path = os.path.join(directory, filename)
-            process_line_data(file_path, geotiff_path)
-            break
-    else:
-        print(f"No supported files ({', '.join(supported_extensions)}) found in the current directory.")
+    args = parse_arguments()
+    file_paths = find_input_files(args.inputs)
+    if not file_paths:
+        print(f"No supported files ({', '.join(SUPPORTED_EXTENSIONS)}) found.")
+        return
+
+    options = {
+        'fixed_distance': args.spacing,
+        'include_original_nodes': args.spacing == 0 or args.include_original_nodes,
+        'retain_attributes': args.retain_attributes,
+        'export_shapefile': args.shapefile,
+        'field_name': args.field
+    }
+    report_df, report_file = process_line_data(file_paths, args.geotiff, options, args.output_dir, args.method, args.workers)
+    print(f"Complete. Total {len(report_df)} lines from {len(file_paths)} files processed. Report saved to '{report_file}'.")
 
 if __name__ == "__main__":
     main()
@@ -3,110 +3,219 @@ import pandas as pd
 from shapely.geometry import Point, LineString
 import numpy as np
 import os
+import argparse
+import glob
+import json
+from multiprocessing import Pool
 from pyproj import Transformer
 from shapely.geometry import MultiLineString
 
-def main():
-    # Input the line data
-    file_path = input("Enter the file path for the line data (e.g., data.gpkg): ")
-    gdf = gpd.read_file(file_path)
+SUPPORTED_EXTENSIONS = [".gpkg", ".geojson", ".shp"]
 
-    output_directory = "output_files_with_nodes_and_crs"
-    os.makedirs(output_directory, exist_ok=True)
+worker = {}
+
+def init_worker():
+    worker['transformers'] = {}
 
-    fixed_distance = input("Enter the spacing distance: ")
-    fixed_distance = float(fixed_distance)
-    include_original_nodes = input("Include original nodes? (yes/no): ").strip().lower() == 'yes'
-    retain_attributes = input("Retain original line attributes? (yes/no): ").strip().lower() == 'yes'
+def get_transformer(crs_from, crs_to):
+    # Transformers are built once per worker and CRS pair
+    key = (crs_from, crs_to)
+    if key not in worker['transformers']:
+        worker['transformers'][key] = Transformer.from_crs(crs_from, crs_to, always_xy=True)
+    return worker['transformers'][key]
 
-    print("All the columns:", gdf.columns.tolist())
-    print("First 10 rows:")
-    print(gdf.head(10))
-    field_name = input("Classify the segment line naming: ")
+def read_line_data(file_path, field_name):
+    try:
+        gdf = gpd.read_file(file_path)
+    except Exception as e:
+        print(f"Error reading {file_path}: {e}")
+        return None, None
+
+    if gdf.crs is None:
+        print(f"CRS is missing in {file_path}. Manually set CRS to EPSG:3826.")
+        gdf.set_crs("EPSG:3826", inplace=True)
 
     # Check if the field_name is valid
     if field_name not in gdf.columns:
-        print(f"Column '{field_name}' does not exist. Using sequential naming instead.")
+        if field_name:
+            print(f"Column '{field_name}' does not exist in {file_path}. Using sequential naming instead.")
         gdf['segment_name'] = gdf.index.to_series().astype(str)
         field_name = 'segment_name'
+    return gdf, field_name
+
+def process_segment(task):
+    file_path, segment_gdf, field_name, unique_value, options, output_directory = task
+    fixed_distance = options['fixed_distance']
+    include_original_nodes = options['include_original_nodes']
+    retain_attributes = options['retain_attributes']
+
+    transformer_4326_to_3826 = get_transformer("EPSG:4326", "EPSG:3826")
+    transformer_to_4326 = get_transformer(segment_gdf.crs.to_wkt(), "EPSG:4326")
+
+    x, y, kp, counts = [], [], [], []
+    for line in segment_gdf.geometry:
+        length = line.length
+        current_distance = 0
+
+        original_points = []
+        if include_original_nodes:
+            if line.geom_type == 'LineString':
+                original_points = list(line.coords)
+            elif line.geom_type == 'MultiLineString':
+                for linestring in line.geoms:
+                    original_points.extend(linestring.coords)
+
+        # Collect all points, both interpolated and original, without duplication
+        points = set()
+        while current_distance <= length:
+            point = line.interpolate(current_distance)
+            points.add((point, current_distance))
+            current_distance += fixed_distance
+        
+        if include_original_nodes:
+            for pt in original_points:
+                point = Point(pt)
+                distance_along_line = line.project(point)
+                points.add((point, distance_along_line))
+        
+        # Sort points by distance along the line
+        sorted_points = sorted(points, key=lambda x: x[1])
+        
+        counts.append(len(sorted_points))
+        x.extend(point.x for point, _ in sorted_points)
+        y.extend(point.y for point, _ in sorted_points)
+        kp.extend(distance_along_line for _, distance_along_line in sorted_points)
+
+    if not kp:
+        return None
+
+    # Generate nodes data as columns for the whole segment, with recalculated distances
+    x, y, kp, counts = np.array(x), np.array(y), np.array(kp), np.array(counts)
+    lon, lat = transformer_to_4326.transform(x, y)
+    easting, northing = transformer_4326_to_3826.transform(lon, lat)
+
+    line_start = np.zeros(len(kp), dtype=bool)
+    line_start[(np.cumsum(counts) - counts)[counts > 0]] = True
+    distance_meters = np.full(len(kp), np.nan)
+    distance_meters[1:] = np.hypot(np.diff(x), np.diff(y))
+    distance_meters[line_start] = np.nan
+
+    nodes_df = pd.DataFrame({
+        "Longitude": lon,
+        "Latitude": lat,
+        "Easting": easting,
+        "Northing": northing,
+        "Distance_Meters": distance_meters,
+        "Total_Distance": kp,
+        field_name: unique_value
+    })
+
+    if retain_attributes:
+        # One row per node from the line table, joined column-wise
+        attributes = pd.DataFrame(segment_gdf.drop(columns=[col for col in nodes_df.columns if col in segment_gdf.columns]))
+        line_index = np.repeat(np.arange(len(counts)), counts)
+        nodes_df = pd.concat([nodes_df, attributes.iloc[line_index].reset_index(drop=True)], axis=1)
+
+    csv_file = os.path.join(output_directory, f"{unique_value}_nodes.csv")
+    nodes_df.to_csv(csv_file, index=False)
+
+    nodes_gdf = gpd.GeoDataFrame(nodes_df, geometry=gpd.points_from_xy(nodes_df.Longitude, nodes_df.Latitude), crs="EPSG:4326")
+
+    shp_file = os.path.join(output_directory, f"{unique_value}_nodes.shp")
+    nodes_gdf.to_file(shp_file)
+
+    return {
+        "Input": file_path,
+        "Segment": unique_value,
+        "Nodes": len(nodes_df),
+        "Total Distance": nodes_df["Distance_Meters"].sum(),
+        "Output CSV": csv_file,
+        "Output Shapefile": shp_file
+    }
+
+def segment_tasks(file_path, options, output_directory):
+    gdf, field_name = read_line_data(file_path, options['field_name'])
+    if gdf is None:
+        return []
 
-    transformer_4326_to_3826 = Transformer.from_crs("EPSG:4326", "EPSG:3826", always_xy=True)
-    transformer_to_4326 = Transformer.from_crs(gdf.crs, "EPSG:4326", always_xy=True)
-
-    segment_count = 0
+    os.makedirs(output_directory, exist_ok=True)
+    # One pass over the table; groups come out in order of first appearance
+    return [(file_path, segment_gdf, field_name, unique_value, options, output_directory)
+            for unique_value, segment_gdf in gdf.groupby(field_name, sort=False)]
+
+def process_line_data(file_paths, options, output_directory, workers=1):
+    # Segments of every input file go through one pool; each task writes its own outputs
+    tasks = []
+    for file_path in file_paths:
+        file_output = output_directory
+        if len(file_paths) > 1:
+            file_output = os.path.join(output_directory, os.path.splitext(os.path.basename(file_path))[0])
+        tasks.extend(segment_tasks(file_path, options, file_output))
+
+    if workers > 1 and len(tasks) > 1:
+        with Pool(processes=min(workers, len(tasks)), initializer=init_worker) as pool:
+            report_data = pool.map(process_segment, tasks, chunksize=1)
+    else:
+        init_worker()
+        report_data = [process_segment(task) for task in tasks]
+
+    report_data = [report for report in report_data if report is not None]
+    os.makedirs(output_directory, exist_ok=True)
+    report_df = pd.DataFrame(report_data, columns=["Input", "Segment", "Nodes", "Total Distance", "Output CSV", "Output Shapefile"])
+    report_file = os.path.join(output_directory, "processing_report.csv")
+    report_df.to_csv(report_file, index=False)
+    return report_df, report_file
+
+def find_input_files(patterns):
+    if not patterns:
+        patterns = ["*" + ext for ext in SUPPORTED_EXTENSIONS]
+
+    file_paths = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern))
+        if not matches:
+            print(f"No files match '{pattern}'.")
+        for file_path in matches:
+            if file_path.endswith(tuple(SUPPORTED_EXTENSIONS)) and file_path not in file_paths:
+                file_paths.append(file_path)
+    return file_paths
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Extract nodes along lines and write one node table and Shapefile per segment.")
+    parser.add_argument("inputs", nargs="*", help="vector files or glob patterns (default: every .gpkg/.geojson/.shp in the current directory)")
+    parser.add_argument("--config", help="JSON file with default values for any of the options below, e.g. {\"spacing\": 10, \"field\": \"name\"}")
+    parser.add_argument("--spacing", type=float, default=None, help="spacing distance")
+    parser.add_argument("--include-original-nodes", action="store_true", help="keep the original line vertices between the spacing points")
+    parser.add_argument("--retain-attributes", action="store_true", help="copy the line attributes to every node")
+    parser.add_argument("--field", default=None, help="column naming the segments (default: sequential naming)")
+    parser.add_argument("--output-dir", default="output_files_with_nodes_and_crs", help="output directory")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="number of worker processes")
+
+    # Values from the config file become the defaults, so command line options still win
+    args, _ = parser.parse_known_args()
+    if args.config:
+        with open(args.config) as f:
+            parser.set_defaults(**{key.replace("-", "_"): value for key, value in json.load(f).items()})
+    args = parser.parse_args()
+    if args.spacing is None or args.spacing <= 0:
+        parser.error("--spacing must be given (on the command line or in --config) and be greater than 0")
+    return args
 
-    for unique_value in gdf[field_name].unique():
-        segment_gdf = gdf[gdf[field_name] == unique_value]
-        
-        nodes_data = []
-        for _, row in segment_gdf.iterrows():
-            line = row.geometry
-            length = line.length
-            current_distance = 0
-
-            original_points = []
-            if include_original_nodes:
-                if line.geom_type == 'LineString':
-                    original_points = list(line.coords)
-                elif line.geom_type == 'MultiLineString':
-                    for linestring in line.geoms:
-                        original_points.extend(linestring.coords)
-
-            # Collect all points, both interpolated and original, without duplication
-            points = set()
-            while current_distance <= length:
-                point = line.interpolate(current_distance)
-                points.add((point, current_distance))
-                current_distance += fixed_distance
-            
-            if include_original_nodes:
-                for pt in original_points:
-                    point = Point(pt)
-                    distance_along_line = line.project(point)
-                    points.add((point, distance_along_line))
-            
-            # Sort points by distance along the line
-            sorted_points = sorted(points, key=lambda x: x[1])
-            
-            # Generate nodes data with recalculated distances
-            for i, (point, distance_along_line) in enumerate(sorted_points):
-                lon, lat = transformer_to_4326.transform(point.x, point.y)
-                easting, northing = transformer_4326_to_3826.transform(lon, lat)
-
-                distance_meters = None if i == 0 else point.distance(Point(sorted_points[i-1][0]))
-                node_data = {
-                    "Longitude": lon,
-                    "Latitude": lat,
-                    "Easting": easting,
-                    "Northing": northing,
-                    "Distance_Meters": distance_meters,
-                    "Total_Distance": distance_along_line,
-                    field_name: unique_value
-                }
-
-                if retain_attributes:
-                    for col in gdf.columns:
-                        if col not in node_data:
-                            node_data[col] = row[col]
-
-                nodes_data.append(node_data)
-
-        if nodes_data:
-            segment_count += 1
-
-            nodes_df = pd.DataFrame(nodes_data)
-            csv_file_name = input(f"Enter the file name for the CSV output for segment '{unique_value}' (without extension): ")
-            csv_file = os.path.join(output_directory, f"{csv_file_name}_nodes.csv")
-            nodes_df.to_csv(csv_file, index=False)
-
-            geometry = [Point(xy) for xy in zip(nodes_df.Longitude, nodes_df.Latitude)]
-            nodes_gdf = gpd.GeoDataFrame(nodes_df, geometry=geometry, crs="EPSG:4326")
-
-            shp_file_name = input(f"Enter the file name for the Shapefile output for segment '{unique_value}' (without extension): ")
-            shp_file = os.path.join(output_directory, f"{shp_file_name}_nodes.shp")
-            nodes_gdf.to_file(shp_file)
-
-    print(f"Complete. Total {segment_count} lines processed, output under '{output_directory}'.")
+def main():
+    args = parse_arguments()
+    file_paths = find_input_files(args.inputs)
+    if not file_paths:
+        print(f"No supported files ({', '.join(SUPPORTED_EXTENSIONS)}) found.")
+        return
+
+    options = {
+        'fixed_distance': args.spacing,
+        'include_original_nodes': args.include_original_nodes,
+        'retain_attributes': args.retain_attributes,
+        'field_name': args.field
+    }
+    report_df, report_file = process_line_data(file_paths, options, args.output_dir, args.workers)
+    print(f"Complete. Total {len(report_df)} lines from {len(file_paths)} files processed. Report saved to '{report_file}'.")
 
 if __name__ == "__main__":
     main()
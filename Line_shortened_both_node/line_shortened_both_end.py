@@ -0,0 +1,123 @@
+import argparse
+import numpy as np
+import geopandas as gpd
+import shapely
+
+
+def read_shp(file_path):
+    return gpd.read_file(file_path)
+
+def line_parts(geometries):
+    # Every LineString part, with the index of the feature it came from (MultiLineStrings are split)
+    geometries = np.asarray(geometries, dtype=object)
+    lines = shapely.get_type_id(geometries) == shapely.GeometryType.LINESTRING
+    multilines = shapely.get_type_id(geometries) == shapely.GeometryType.MULTILINESTRING
+    candidates = np.flatnonzero(lines | multilines)
+    parts, part_index = shapely.get_parts(geometries[candidates], return_index=True)
+    keep = ~shapely.is_empty(parts)
+    return parts[keep], candidates[part_index[keep]]
+
+def extract_endpoints(geodataframe):
+    parts, feature_index = line_parts(geodataframe.geometry.values)
+
+    # Start and end point of every part, interleaved like the original per-line loop
+    points = np.empty(2 * len(parts), dtype=object)
+    points[0::2] = shapely.get_point(parts, 0)
+    points[1::2] = shapely.get_point(parts, -1)
+
+    endpoints = geodataframe.iloc[np.repeat(feature_index, 2)].reset_index(drop=True)
+    endpoints['endpoint'] = np.tile(['start', 'end'], len(parts))
+    endpoints[geodataframe.geometry.name] = gpd.GeoSeries(points, crs=geodataframe.crs)
+    return endpoints
+
+def shorten_geometries(geometries, distance):
+    # Trim `distance` off both ends of every LineString/MultiLineString part in one array pass.
+    # Returns an object array aligned with `geometries`, None where nothing is left.
+    if distance < 0:
+        raise ValueError(f"distance must not be negative, got {distance}")
+    geometries = np.asarray(geometries, dtype=object)
+    parts, feature_index = line_parts(geometries)
+    result = np.full(len(geometries), None, dtype=object)
+    if len(parts) == 0:
+        return result
+
+    include_z = bool(shapely.has_z(parts).any())
+    coords, vertex_part = shapely.get_coordinates(parts, include_z=include_z, return_index=True)
+
+    # Chainage of every vertex along its own part (the jump between parts counts as zero)
+    step = np.zeros(len(coords))
+    step[1:] = np.hypot(*np.diff(coords[:, :2], axis=0).T)
+    step[1:][vertex_part[1:] != vertex_part[:-1]] = 0
+    chainage = np.cumsum(step)
+    first_vertex = np.searchsorted(vertex_part, np.arange(len(parts)))
+    last_vertex = np.searchsorted(vertex_part, np.arange(len(parts)), side='right') - 1
+    part_start = chainage[first_vertex]
+    length = chainage[last_vertex] - part_start
+
+    kept = np.flatnonzero(length > 2 * distance)
+    if len(kept) == 0:
+        return result
+
+    def interpolate(target, kept):
+        # Point at the given global chainage, on the segment of its own part that contains it.
+        # Chainage does not grow between parts, so the search is clipped to the part's own segments.
+        k = np.searchsorted(chainage, target, side='left')
+        k = np.clip(k, first_vertex[kept] + 1, last_vertex[kept])
+        segment = chainage[k] - chainage[k - 1]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            ratio = np.where(segment > 0, (target - chainage[k - 1]) / segment, 0.0)
+        return coords[k - 1] + (coords[k] - coords[k - 1]) * ratio[:, np.newaxis]
+
+    start = interpolate(part_start[kept] + distance, kept)
+    end = interpolate(part_start[kept] + length[kept] - distance, kept)
+
+    # Interior vertices strictly between the two cut points are the only ones kept
+    local = chainage - part_start[vertex_part]
+    interior = np.isin(vertex_part, kept) & (local > distance) & (local < length[vertex_part] - distance)
+
+    new_coords = np.concatenate([start, coords[interior], end])
+    new_part = np.concatenate([kept, vertex_part[interior], kept])
+    order_key = np.concatenate([np.full(len(kept), -1), np.flatnonzero(interior), np.full(len(kept), len(coords))])
+    order = np.lexsort((order_key, new_part))
+    new_lines = shapely.linestrings(new_coords[order], indices=np.searchsorted(kept, new_part[order]))
+
+    # Parts go back to their features: LineStrings stay LineStrings, MultiLineStrings keep their remaining parts
+    kept_feature = feature_index[kept]
+    multi = shapely.get_type_id(geometries[kept_feature]) == shapely.GeometryType.MULTILINESTRING
+    single = kept_feature[~multi]
+    result[single] = new_lines[~multi]
+    if multi.any():
+        features, multi_index = np.unique(kept_feature[multi], return_inverse=True)
+        result[features] = shapely.multilinestrings(new_lines[multi], indices=multi_index)
+    return result
+
+def shorten_line(line, distance):
+    return shorten_geometries([line], distance)[0]
+
+def shorten_lines(geodataframe, distance):
+    shortened = shorten_geometries(geodataframe.geometry.values, distance)
+    keep = ~shapely.is_missing(shortened)
+    shortened_gdf = geodataframe[keep].copy()
+    shortened_gdf[shortened_gdf.geometry.name] = gpd.GeoSeries(shortened[keep], index=shortened_gdf.index, crs=geodataframe.crs)
+    return shortened_gdf
+
+def main(input_shp, output_endpoints_shp, output_shortened_shp, distance=100):
+
+    gdf = read_shp(input_shp)
+
+    endpoints_gdf = extract_endpoints(gdf)
+    endpoints_gdf.to_file(output_endpoints_shp)
+
+    shortened_gdf = shorten_lines(gdf, distance)
+    shortened_gdf.to_file(output_shortened_shp)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Extract the end nodes of every line and shorten the lines at both ends.')
+    parser.add_argument('input_shp', help='input line file')
+    parser.add_argument('--endpoints', default='endpoints.shp', help='output file for the end nodes')
+    parser.add_argument('--shortened', default='shortened_lines.shp', help='output file for the shortened lines')
+    parser.add_argument('--distance', type=float, default=100, help='distance trimmed from each end')
+    args = parser.parse_args()
+    if args.distance <= 0:
+        parser.error('--distance must be greater than 0')
+    main(args.input_shp, args.endpoints, args.shortened, args.distance)
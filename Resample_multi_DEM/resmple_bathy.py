@@ -1,29 +1,44 @@
 # Griding bathymetry data from BDB source
 # version 2021-10-25 Ming-Yi Hsu
-# version 2021-12-01 Ming-Yi Hsu Modified the smoothing function based on IHO and GEBCO(LOWESS) 
+# version 2021-12-01 Ming-Yi Hsu Modified the smoothing function based on IHO and GEBCO(LOWESS)
 # version 2023-06-12 Ming-Yi Hsu Fixed some issue
 
 
+import base64
+import json
+import os
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
 import pandas as pd
 from scipy.ndimage import gaussian_filter
 import numpy as np
 import rasterio
-from rasterio.warp import reproject, Resampling
+from rasterio.warp import reproject, Resampling, transform_bounds
+from rasterio.windows import Window, from_bounds
 from statsmodels.nonparametric.smoothers_lowess import lowess
 import scipy.ndimage
-from scipy.ndimage import binary_closing
-from scipy.spatial import cKDTree
+from scipy.ndimage import binary_closing, binary_dilation, convolve, correlate1d, uniform_filter
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import raster_io
 
 
-# Step 1: Read CSV file
-df = pd.read_csv('file_list.csv')
-# Convert quality to sortable form
-quality_dict = {'A2': 0, 'B': 1, 'C': 2, 'D': 3}
-df['quality_sortable'] = df['CATZOC'].map(quality_dict)
-
-# Sort by date and quality
-df = df.sort_values(by=['DATEND', 'quality_sortable'], ascending=[False, True])
+# Parameters for user to adjust
+resolution = 1  # 10 meters per pixel
+default_crs = raster_io.DEFAULT_CRS  # CRS assumed for files without one
+survey_index_path = 'survey_index.json'  # Footprint index cached between runs, keyed by path and modification time
+footprint_cell_size = 32  # Survey pixels per cell of the cached valid-data footprint
+mosaic_memmap_path = None  # Keep the composite in a memory-mapped .npy file (e.g. 'mosaic.npy') instead of RAM
+reproject_workers = os.cpu_count()  # Surveys reprojected concurrently (GDAL releases the GIL)
+reproject_queue_size = 2 * reproject_workers  # Reprojected windows held in memory while waiting to be merged
+reproject_strip_rows = 512  # Mosaic rows reprojected per source read, bounds the survey data each thread holds
+hole_fill_radius = 5  # Holes are filled with the mean of the valid pixels within this radius (pixels)
+hole_fill_kernel = 'disc'  # 'disc' (Euclidean radius) or 'box' (square window, faster)
+smoothing_method = 'kernel'  # 'kernel' (vectorized LOWESS) or 'lowess' (statsmodels, one row or column at a time)
+smoothing_frac = 0.08  # Fraction of the valid points of a row/column used for each local fit
+smoothing_workers = os.cpu_count()  # Rows and columns are smoothed in parallel across this many workers
 
 
 
@@ -31,108 +46,242 @@ df = df.sort_values(by=['DATEND', 'quality_sortable'], ascending=[False, True])
 def get_bounds(dataset):
     left, bottom, right, top = dataset.bounds
     return left, bottom, right, top
-    
-    
-    
-    
-# Step 2: Calculate the overall bounding box
-overall_left = float('inf')
-overall_bottom = float('inf')
-overall_right = float('-inf')
-overall_top = float('-inf')
-
-for index, row in df.iterrows():
-    file_path = row['path']
-    try:
-        with rasterio.open(file_path) as dataset:
-            left, bottom, right, top = get_bounds(dataset)
-            overall_left = min(overall_left, left)
-            overall_bottom = min(overall_bottom, bottom)
-            overall_right = max(overall_right, right)
-            overall_top = max(overall_top, top)
-    except rasterio.errors.RasterioIOError:
-        print(f"Could not load {file_path}")
-        
-
-# Step 3: Create a new raster that covers the overall bounding box
-resolution = 1  # 10 meters per pixel
-width = int((overall_right - overall_left) / resolution)
-height = int((overall_top - overall_bottom) / resolution)
-transform = rasterio.transform.from_origin(overall_left, overall_top, resolution, resolution)
-
-# Use the same CRS as the first GeoTIFF file
-with rasterio.open(df['path'][0]) as first_dataset:
-    crs = first_dataset.crs if first_dataset.crs else rasterio.crs.CRS.from_string('EPSG:3826')
-
-# Initialize all pixel values to NaN
-data = np.full((height, width), np.nan)
-
-# Initialize a mask that tracks which pixels have been filled
-filled_mask = np.zeros((height, width), dtype=bool)
-
-# Create the new GeoTIFF file
-with rasterio.open('output.tif', 'w', driver='GTiff',
-                   height=height, width=width, count=1, dtype=str(data.dtype),
-                   crs=crs, transform=transform) as dst:
-    dst.write(data, 1)
-
 
 
+# Bounds, CRS, resolution and a coarse valid-data footprint of one survey
+def index_survey(file_path):
+    file_stat = os.stat(file_path)
+    with rasterio.open(file_path) as src:
+        # A footprint cell is valid when any survey pixel inside it is valid. Rows of cells are read in strips at
+        # least one block high, so every block is decoded about once without going through the block cache.
+        # The windows run past the raster edge, which raster_io fills with NaN, so every strip reshapes evenly.
+        cells = footprint_cell_size
+        rows, cols = -(-src.height // cells), -(-src.width // cells)
+        strip_rows = -(-src.block_shapes[0][0] // cells)
+        footprint = np.zeros((rows, cols), dtype=bool)
+        for row in range(0, rows, strip_rows):
+            strip = raster_io.read_window(src, Window(0, row * cells, cols * cells, strip_rows * cells), cache=False)
+            strip_footprint = (~np.isnan(strip)).reshape(strip_rows, cells, cols, cells).any(axis=(1, 3))
+            footprint[row:row + strip_rows] = strip_footprint[:rows - row]
+
+        return {
+            'mtime': file_stat.st_mtime,
+            'size': file_stat.st_size,
+            'bounds': list(get_bounds(src)),
+            'crs': src.crs.to_wkt() if src.crs else None,
+            'res': list(src.res),
+            'footprint_transform': list(src.transform * rasterio.Affine.scale(cells))[:6],
+            'footprint_shape': [rows, cols],
+            'footprint': base64.b64encode(np.packbits(footprint).tobytes()).decode('ascii'),
+        }
+
+
+def load_survey_index(index_path):
+    if index_path and os.path.exists(index_path):
+        with open(index_path) as f:
+            return json.load(f)
+    return {}
+
+
+def save_survey_index(survey_index, index_path):
+    if index_path:
+        with open(index_path, 'w') as f:
+            json.dump(survey_index, f)
+
+
+# Only open the surveys that are new or changed since the index was written;
+# entries of surveys no longer in the file list are dropped, so the saved index does not keep stale footprints
+def update_survey_index(survey_index, paths):
+    paths = list(paths)
+    for file_path in set(survey_index) - set(paths):
+        del survey_index[file_path]
+
+    updated = 0
+    for file_path in paths:
+        try:
+            file_stat = os.stat(file_path)
+            entry = survey_index.get(file_path)
+            if entry and entry['mtime'] == file_stat.st_mtime and entry['size'] == file_stat.st_size:
+                continue
+            survey_index[file_path] = index_survey(file_path)
+            updated += 1
+        except (OSError, rasterio.errors.RasterioIOError):
+            survey_index.pop(file_path, None)
+            print(f"Could not load {file_path}")
+    return updated
 
-# Step 4: Fill the new raster file
-with rasterio.open('output.tif', 'r+') as dst:
-    for index, row in df.iterrows():
-        # If all pixels have been filled, we can stop
-        if filled_mask.all():
-            print(f"All pixels filled after {index} files.")
-            break
 
-        file_path = row['path']
-        try:
-            with rasterio.open(file_path) as src:
-                # Check if the CRS is defined, if not assume it is 'EPSG:3826'
-                src_crs = src.crs if src.crs else rasterio.crs.CRS.from_string('EPSG:3826')
+def survey_crs(entry):
+    return rasterio.crs.CRS.from_wkt(entry['crs']) if entry['crs'] else rasterio.crs.CRS.from_string(default_crs)
 
-                # Create a temporary array for the reprojected data
-                reprojected_data = np.empty_like(dst.read(1))
 
+# A survey cannot contribute when every mosaic pixel of its valid footprint is already filled
+def survey_is_covered(entry, filled_mask, dst_transform, dst_crs):
+    try:
+        window = survey_window(entry['bounds'], survey_crs(entry), dst_transform, dst_crs, filled_mask.shape)
+    except rasterio.errors.WindowError:
+        return True
+    rows, cols = window.toslices()
+
+    footprint = np.unpackbits(np.frombuffer(base64.b64decode(entry['footprint']), dtype=np.uint8),
+                              count=int(np.prod(entry['footprint_shape']))).reshape(entry['footprint_shape'])
+    window_footprint = np.zeros((rows.stop - rows.start, cols.stop - cols.start), dtype=np.uint8)
+    reproject(
+        source=footprint,
+        destination=window_footprint,
+        src_transform=rasterio.Affine(*entry['footprint_transform']),
+        src_crs=survey_crs(entry),
+        dst_transform=rasterio.windows.transform(window, dst_transform),
+        dst_crs=dst_crs,
+        resampling=Resampling.max)
+
+    # Grow by one pixel so the footprint is conservative at cell edges
+    window_footprint = binary_dilation(window_footprint.astype(bool))
+    return bool(filled_mask[rows, cols][window_footprint].all())
+
+
+# Window of the mosaic covered by a survey, so each survey is only reprojected into its own footprint
+def survey_window(src_bounds, src_crs, dst_transform, dst_crs, dst_shape):
+    left, bottom, right, top = transform_bounds(src_crs, dst_crs, *src_bounds)
+    window = from_bounds(left, bottom, right, top, transform=dst_transform)
+    window = window.round_offsets(op='floor').round_lengths(op='ceil')
+    # Grow by one pixel so partially covered edge pixels are not lost to rounding
+    window = Window(window.col_off - 1, window.row_off - 1, window.width + 2, window.height + 2)
+    return window.intersection(Window(0, 0, dst_shape[1], dst_shape[0]))
+
+
+# Reproject one survey into the window its bounds cover; runs in a worker thread
+def reproject_survey(file_path, dst_transform, dst_crs, dst_shape, strip_rows=512):
+    try:
+        with rasterio.open(file_path) as src:
+            # Check if the CRS is defined, if not assume the default CRS
+            src_crs = raster_io.raster_crs(src, default_crs)
+
+            try:
+                window = survey_window(src.bounds, src_crs, dst_transform, dst_crs, dst_shape)
+            except rasterio.errors.WindowError:
+                return None
+
+            window_transform = rasterio.windows.transform(window, dst_transform)
+            reprojected_data = np.full((int(window.height), int(window.width)), np.nan)
+            for row_off in range(0, reprojected_data.shape[0], strip_rows):
+                strip = Window(0, row_off, reprojected_data.shape[1], min(strip_rows, reprojected_data.shape[0] - row_off))
+                strip_transform = rasterio.windows.transform(strip, window_transform)
+
+                # Only the survey pixels under this strip are read, with a margin for the averaging footprint
+                strip_bounds = transform_bounds(dst_crs, src_crs, *rasterio.windows.bounds(strip, window_transform))
+                source_window = from_bounds(*strip_bounds, transform=src.transform)
+                source_window = source_window.round_offsets(op='floor').round_lengths(op='ceil')
+                try:
+                    source_window = Window(source_window.col_off - 2, source_window.row_off - 2,
+                                           source_window.width + 4, source_window.height + 4
+                                           ).intersection(Window(0, 0, src.width, src.height))
+                except rasterio.errors.WindowError:
+                    continue
+
+                # Every kind of nodata (declared, -9999, NaN) is NaN here, so none of it is averaged into the mosaic.
+                # The strip is read once, so it bypasses the shared block cache.
                 reproject(
-                    source=rasterio.band(src, 1),
-                    destination=reprojected_data,
-                    src_transform=src.transform,
+                    source=raster_io.read_window(src, source_window, cache=False),
+                    destination=reprojected_data[strip.toslices()],
+                    src_transform=src.window_transform(source_window),
                     src_crs=src_crs,
-                    dst_transform=dst.transform,
-                    dst_crs=dst.crs,
+                    src_nodata=np.nan,
+                    dst_transform=strip_transform,
+                    dst_crs=dst_crs,
+                    dst_nodata=np.nan,
                     resampling=Resampling.average)
+            return window, reprojected_data
 
-                # Only fill the pixels that have not been filled yet
-                data = dst.read(1)  # Read the current data
-                np.copyto(data, reprojected_data, where=~filled_mask)  # Update the data with the reprojected data
-                dst.write(data, 1)  # Write the data back to the GeoTIFF file
-
-                # Update the filled_mask
-                filled_mask[~np.isnan(reprojected_data)] = True
-
-        except rasterio.errors.RasterioIOError:
-            print(f"Could not load {file_path}")
-
-
-    # Fill holes that are within 10 pixels from valid data
-    y_indices, x_indices = np.indices(data.shape)
-    valid_mask = ~np.isnan(data)
-    valid_y_indices = y_indices[valid_mask]
-    valid_x_indices = x_indices[valid_mask]
-    valid_values = data[valid_mask]
-
-    tree = cKDTree(np.column_stack((valid_y_indices, valid_x_indices)))
-    hole_y_indices = y_indices[~valid_mask]
-    hole_x_indices = x_indices[~valid_mask]
-    distances, indices = tree.query(np.column_stack((hole_y_indices, hole_x_indices)), k=5, distance_upper_bound=10)    
-    
-    # Create a mask for valid indices
-    valid_indices_mask = indices != tree.n
-    
-
+    except rasterio.errors.RasterioIOError:
+        print(f"Could not load {file_path}")
+        return None
+
+
+# Mosaic engine: composite and filled_mask stay in memory (or a memory map) and are written to disk once.
+# Surveys are reprojected concurrently, but merged one at a time in the DATEND/CATZOC priority order.
+def mosaic_surveys(df, dst_transform, dst_crs, dst_shape, survey_index=None, workers=1, queue_size=2):
+    if mosaic_memmap_path:
+        data = np.lib.format.open_memmap(mosaic_memmap_path, mode='w+', dtype=np.float64, shape=dst_shape)
+        data[:] = np.nan
+    else:
+        # Initialize all pixel values to NaN
+        data = np.full(dst_shape, np.nan)
+
+    # Initialize a mask that tracks which pixels have been filled
+    filled_mask = np.zeros(dst_shape, dtype=bool)
+    filled_count = 0
+    skipped = 0
+    merged = 0
+
+    paths = list(df['path'])
+    next_path = 0
+    pending = deque()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while next_path < len(paths) or pending:
+            # Keep the queue full; at most queue_size reprojected windows are held in memory
+            while next_path < len(paths) and len(pending) < queue_size:
+                file_path = paths[next_path]
+                next_path += 1
+
+                # Skip surveys already covered by higher-priority data without opening them
+                entry = survey_index.get(file_path) if survey_index else None
+                if entry is not None and survey_is_covered(entry, filled_mask, dst_transform, dst_crs):
+                    skipped += 1
+                    continue
+
+                pending.append((entry, executor.submit(reproject_survey, file_path, dst_transform, dst_crs, dst_shape,
+                                                        reproject_strip_rows)))
+
+            if not pending:
+                break
+
+            # Single consumer: merge the oldest survey first, so the priority order is kept
+            entry, future = pending.popleft()
+            result = future.result()
+            merged += 1
+            if result is None:
+                continue
+
+            window, reprojected_data = result
+            rows, cols = window.toslices()
+            filled_block = filled_mask[rows, cols]
+
+            # Only fill the pixels that have not been filled yet
+            np.copyto(data[rows, cols], reprojected_data, where=~filled_block)
+
+            # Update the filled_mask
+            newly_filled = ~filled_block & ~np.isnan(reprojected_data)
+            filled_block |= newly_filled
+            filled_count += int(np.count_nonzero(newly_filled))
+
+            # The queued surveys were only checked against the surveys merged before they were submitted;
+            # drop the ones this merge covered, cancelling those that have not started yet
+            if newly_filled.any():
+                still_pending = deque()
+                for entry, future in pending:
+                    if entry is not None and survey_is_covered(entry, filled_mask, dst_transform, dst_crs):
+                        future.cancel()
+                        skipped += 1
+                    else:
+                        still_pending.append((entry, future))
+                pending = still_pending
+
+            # If all pixels have been filled, we can stop
+            if filled_count == filled_mask.size:
+                print(f"All pixels filled after {merged} files.")
+                for _, future in pending:
+                    future.cancel()
+                break
+
+    if skipped:
+        print(f"Skipped {skipped} surveys already covered by higher-priority data.")
+    return data, filled_mask
+
+
+# Fill holes surrounded by valid data with the mean of the valid pixels within a radius, as one convolution
+def fill_holes(data, radius=5, kernel='disc'):
     # Create a binary mask for the valid data
     binary_mask = ~np.isnan(data)
 
@@ -141,27 +290,29 @@ with rasterio.open('output.tif', 'r+') as dst:
 
     # Find holes that are surrounded by valid data
     surrounded_holes = np.logical_and(~binary_mask, closed_mask)
+    if not surrounded_holes.any():
+        return data
 
-    # Find the y and x indices of the surrounded holes
-    surrounded_holes_y_indices = y_indices[surrounded_holes]
-    surrounded_holes_x_indices = x_indices[surrounded_holes]
-
-    # Fill the surrounded holes
-    for y, x in zip(surrounded_holes_y_indices, surrounded_holes_x_indices):
-        indices = tree.query_ball_point((y, x), r=5)  # Adjust the radius as needed
-
-        # If there are no points within the radius, continue to the next hole
-        if len(indices) == 0:
-            continue
-
-        # Average the values of the points within the radius
-        hole_value = np.average(valid_values[indices])
+    # Sum and count of the valid pixels around every pixel
+    values = np.where(binary_mask, data, 0.0)
+    valid = binary_mask.astype(np.float64)
+    if kernel == 'box':
+        size = 2 * int(radius) + 1
+        value_sum = uniform_filter(values, size=size, mode='constant') * size ** 2
+        valid_count = np.rint(uniform_filter(valid, size=size, mode='constant') * size ** 2)
+    else:
+        offset = int(radius)
+        y_offsets, x_offsets = np.mgrid[-offset:offset + 1, -offset:offset + 1]
+        footprint = (y_offsets ** 2 + x_offsets ** 2 <= radius ** 2).astype(np.float64)
+        value_sum = convolve(values, footprint, mode='constant')
+        valid_count = convolve(valid, footprint, mode='constant')
+
+    # Fill the surrounded holes that have at least one valid pixel within the radius
+    fillable = surrounded_holes & (valid_count > 0)
+    data[fillable] = value_sum[fillable] / valid_count[fillable]
+    return data
 
-        # Fill the hole with the averaged value
-        data[y, x] = hole_value
 
-    dst.write(data, 1)
-    
 def smooth_lowess(data, frac=0.08):
     x = np.arange(data.shape[0])
     valid_mask = ~np.isnan(data)
@@ -178,25 +329,212 @@ def smooth_lowess(data, frac=0.08):
     smoothed[valid_mask] = np.interp(x_valid, smoothed_valid[:, 0], smoothed_valid[:, 1])
     return smoothed
 
-def smooth_lowess_2d(data, frac=0.08):
+def smooth_lowess_2d(data, frac=0.08, workers=1):
     smoothed = np.empty_like(data)
 
-    # Apply LOWESS to each row
-    for i in range(data.shape[0]):
-        smoothed[i, :] = smooth_lowess(data[i, :], frac=frac)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        chunksize = max(1, max(data.shape) // (workers * 4))
+        # Apply LOWESS to each row
+        for i, row in enumerate(executor.map(partial(smooth_lowess, frac=frac), data, chunksize=chunksize)):
+            smoothed[i, :] = row
+
+        # Apply LOWESS to each column
+        for i, column in enumerate(executor.map(partial(smooth_lowess, frac=frac), smoothed.T.copy(),
+                                                chunksize=chunksize)):
+            smoothed[:, i] = column
+
+    return smoothed
+
 
-    # Apply LOWESS to each column
-    for i in range(data.shape[1]):
-        smoothed[:, i] = smooth_lowess(smoothed[:, i], frac=frac)
+# Weighted local linear estimate at offset 0 from the kernel moments, computed the way LOWESS does it
+def local_linear_estimate(s0, s1, s2, t0, t1, nonzero, values):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_offset, mean_value = s1 / s0, t0 / s0
+        variance = np.maximum(s2 / s0 - mean_offset ** 2, 1e-12)
+        fitted = mean_value - mean_offset * (t1 / s0 - mean_offset * mean_value) / variance
+    # With fewer than two weighted points LOWESS keeps the observation itself
+    return np.where(nonzero >= 2, fitted, values)
+
+
+# Distance from every query point to the k-th nearest valid point of its own line, by bisection on the distance.
+# keys are the sorted line * stride + column keys of the valid points, so one searchsorted covers all lines.
+def kth_neighbour_distance(keys, query_keys, k, max_distance):
+    low = np.zeros(len(query_keys), dtype=np.int64)  # Fewer than k points within this distance
+    high = np.full(len(query_keys), max_distance, dtype=np.int64)  # At least k points within this distance
+    while np.any(high - low > 1):
+        middle = (low + high) // 2
+        count = np.searchsorted(keys, query_keys + middle, 'right') - np.searchsorted(keys, query_keys - middle, 'left')
+        enough = count >= k
+        high = np.where(enough, middle, high)
+        low = np.where(enough, low, middle)
+    return high
+
+
+# LOWESS along axis 1 for lines sharing the neighbourhood size k. Every point is fitted on its k nearest valid
+# points with a tricube whose radius is the distance of the k-th one. Inside runs without gaps that radius is
+# k // 2 for every point, so those fits are five 1D correlations; points near line ends and gaps, where LOWESS
+# widens the window to one side, are fitted from their gathered neighbourhoods with their own radius.
+def tricube_local_linear(lines, k, iterations=3, gather_size=2 ** 22):
+    radius = k // 2
+    offsets = np.arange(-radius, radius + 1, dtype=np.float64)
+    kernel = (1 - (np.abs(offsets) / radius) ** 3) ** 3
+    kernels = [kernel, kernel * offsets, kernel * offsets ** 2]
+    inner = np.ones(2 * radius - 1)  # Offsets closer than the radius, the only ones with a non-zero weight
+
+    valid_mask = ~np.isnan(lines)
+    values = np.where(valid_mask, lines, 0.0)
+    robust_weights = valid_mask.astype(np.float64)
+
+    # Points with fewer than k valid points closer than the radius, and at least k within it, share the kernel
+    closer = correlate1d(robust_weights, inner, axis=1, mode='constant')
+    within = correlate1d(robust_weights, np.ones(2 * radius + 1), axis=1, mode='constant')
+    edge_rows, edge_cols = np.nonzero(valid_mask & ~((closer < k) & (within >= k)))
+
+    # Radius and neighbourhood (the valid points closer than the radius) of every edge point
+    stride = 3 * lines.shape[1]
+    valid_rows, valid_cols = np.nonzero(valid_mask)
+    keys = valid_rows * stride + valid_cols
+    edge_keys = edge_rows * stride + edge_cols
+    edge_radius = kth_neighbour_distance(keys, edge_keys, k, lines.shape[1] - 1)
+    first = np.searchsorted(keys, edge_keys - edge_radius + 1, 'left')
+    stop = np.searchsorted(keys, edge_keys + edge_radius - 1, 'right')
+    width = int((stop - first).max()) if len(first) else 0
+    chunk = max(1, gather_size // max(width, 1))
+
+    for iteration in range(iterations + 1):
+        # Weighted moments of the offsets and of the values around every pixel
+        s0, s1, s2 = (correlate1d(robust_weights, taps, axis=1, mode='constant') for taps in kernels)
+        t0, t1 = (correlate1d(robust_weights * values, taps, axis=1, mode='constant') for taps in kernels[:2])
+        nonzero = correlate1d((robust_weights > 1e-12).astype(np.float64), inner, axis=1, mode='constant')
+        fitted = local_linear_estimate(s0, s1, s2, t0, t1, nonzero, values)
+
+        # Edge points, a chunk at a time so the gathered neighbourhoods stay small
+        for start in range(0, len(edge_rows), chunk):
+            points = slice(start, start + chunk)
+            rows, cols = edge_rows[points, np.newaxis], edge_cols[points, np.newaxis]
+            index = first[points, np.newaxis] + np.arange(width)
+            in_window = index < stop[points, np.newaxis]
+            neighbour_cols = valid_cols[np.minimum(index, len(valid_cols) - 1)]
+            neighbour_offsets = np.where(in_window, neighbour_cols - cols, 0).astype(np.float64)
+            tricube = (1 - (np.abs(neighbour_offsets) / edge_radius[points, np.newaxis]) ** 3) ** 3
+            weights = np.where(in_window, tricube * robust_weights[rows, neighbour_cols], 0.0)
+            weighted_values = weights * values[rows, neighbour_cols]
+            fitted[edge_rows[points], edge_cols[points]] = local_linear_estimate(
+                weights.sum(axis=1), (weights * neighbour_offsets).sum(axis=1),
+                (weights * neighbour_offsets ** 2).sum(axis=1), weighted_values.sum(axis=1),
+                (weighted_values * neighbour_offsets).sum(axis=1), (weights > 1e-12).sum(axis=1),
+                values[edge_rows[points], edge_cols[points]])
+
+        if iteration == iterations:
+            break
 
+        # Bisquare robustness weights from the residuals scaled by six times their median, as in LOWESS
+        residuals = np.where(valid_mask, np.abs(values - fitted), np.nan)
+        median = np.nanmedian(residuals, axis=1, keepdims=True)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            scaled = np.minimum(residuals / (6 * median), 1.0)
+        robust_weights = np.where(median > 0, (1 - scaled ** 2) ** 2, residuals == 0)
+        robust_weights[~valid_mask] = 0.0
+
+    fitted[~valid_mask] = np.nan
+    return fitted
+
+
+# NaN-aware LOWESS smoother along axis 1, vectorized over all lines with the same neighbourhood size
+def smooth_kernel_lines(lines, frac=0.08, iterations=3):
+    smoothed = np.full(lines.shape, np.nan)
+    valid_count = np.count_nonzero(~np.isnan(lines), axis=1)
+    # LOWESS fits every point on its k = frac * n nearest valid points, with 2 <= k <= n
+    neighbours = np.minimum(np.maximum((frac * valid_count + 1e-10).astype(int), 2), valid_count)
+
+    # A single valid point is its own fit
+    single = valid_count == 1
+    smoothed[single] = lines[single]
+
+    # Lines with the same k share one kernel, so each group is a single vectorized pass
+    for k in np.unique(neighbours[valid_count > 1]):
+        group = (neighbours == k) & (valid_count > 1)
+        smoothed[group] = tricube_local_linear(lines[group], int(k), iterations)
     return smoothed
 
 
-with rasterio.open('output.tif') as src:
-    profile = src.profile
-    data = src.read(1)
+def smooth_kernel_2d(data, frac=0.08, iterations=3, workers=1):
+    smooth_lines = partial(smooth_kernel_lines, frac=frac, iterations=iterations)
+    # The 1D correlations release the GIL, so row and column chunks run in threads
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # Apply the smoother to each row
+        row_chunks = np.array_split(np.arange(data.shape[0]), max(1, min(workers, data.shape[0])))
+        smoothed = np.vstack(list(executor.map(lambda rows: smooth_lines(data[rows]), row_chunks)))
+
+        # Apply the smoother to each column
+        column_chunks = np.array_split(np.arange(data.shape[1]), max(1, min(workers, data.shape[1])))
+        smoothed = np.vstack(list(executor.map(lambda columns: smooth_lines(smoothed[:, columns].T),
+                                               column_chunks))).T
+
+    return np.ascontiguousarray(smoothed)
+
+if __name__ == "__main__":
+    # Step 1: Read CSV file
+    df = pd.read_csv('file_list.csv')
+    # Convert quality to sortable form
+    quality_dict = {'A2': 0, 'B': 1, 'C': 2, 'D': 3}
+    df['quality_sortable'] = df['CATZOC'].map(quality_dict)
+
+    # Sort by date and quality
+    df = df.sort_values(by=['DATEND', 'quality_sortable'], ascending=[False, True])
+
+
+    # Index the bounds and footprints of new or changed surveys, the others come from the cache
+    survey_index = load_survey_index(survey_index_path)
+    updated = update_survey_index(survey_index, df['path'])
+    save_survey_index(survey_index, survey_index_path)
+    print(f"Indexed {updated} new or changed surveys ({len(df) - updated} from the cache).")
+
+
+    # Step 2: Calculate the overall bounding box
+    overall_left = float('inf')
+    overall_bottom = float('inf')
+    overall_right = float('-inf')
+    overall_top = float('-inf')
+
+    for file_path in df['path']:
+        if file_path not in survey_index:
+            continue
+        left, bottom, right, top = survey_index[file_path]['bounds']
+        overall_left = min(overall_left, left)
+        overall_bottom = min(overall_bottom, bottom)
+        overall_right = max(overall_right, right)
+        overall_top = max(overall_top, top)
+
+
+    # Step 3: Define the mosaic grid that covers the overall bounding box
+    width = int((overall_right - overall_left) / resolution)
+    height = int((overall_top - overall_bottom) / resolution)
+    transform = rasterio.transform.from_origin(overall_left, overall_top, resolution, resolution)
+
+    # Use the same CRS as the first GeoTIFF file
+    crs = survey_crs(survey_index[df['path'][0]])
+
+
+    # Step 4: Fill the mosaic, then write it to disk once
+    data, filled_mask = mosaic_surveys(df, transform, crs, (height, width), survey_index,
+                                       workers=reproject_workers, queue_size=reproject_queue_size)
+
+    # Fill holes that are surrounded by valid data
+    data = fill_holes(data, radius=hole_fill_radius, kernel=hole_fill_kernel)
+
+    # Create the new GeoTIFF file
+    with rasterio.open('output.tif', 'w', driver='GTiff',
+                       height=height, width=width, count=1, dtype=str(data.dtype),
+                       crs=crs, transform=transform) as dst:
+        dst.write(data, 1)
+        profile = dst.profile
+
 
-smoothed_band = smooth_lowess_2d(data)
+    if smoothing_method == 'lowess':
+        smoothed_band = smooth_lowess_2d(data, frac=smoothing_frac, workers=smoothing_workers)
+    else:
+        smoothed_band = smooth_kernel_2d(data, frac=smoothing_frac, workers=smoothing_workers)
 
-with rasterio.open('output_smoothed.tif', 'w', **src.profile) as dst:
-    dst.write(smoothed_band, 1)
+    with rasterio.open('output_smoothed.tif', 'w', **profile) as dst:
+        dst.write(smoothed_band, 1)
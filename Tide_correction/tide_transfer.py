@@ -5,77 +5,372 @@ author: Ming-Yi Hsu
 """
 
 import os
+import argparse
+import hashlib
+import time
 import numpy as np
 import pandas as pd
-from scipy.spatial import distance
+from scipy import sparse
+from scipy.spatial import cKDTree
 from multiprocessing import cpu_count, Pool
 
 
 
 
-def Read_data(filename):
-    lon=[]
-    lat=[]
-    value=[]
-    with open(filename,'r') as f:
-        data=f.readlines()
+def Read_data_chunks(filename,chunk_size=1000000):
+    # Parse the XYZ text straight into NumPy arrays, chunk by chunk (blank lines are skipped)
+    # round_trip parsing gives the same floats as Python's float()
+    reader=pd.read_csv(filename,sep=r'\s+',header=None,usecols=[0,1,2],dtype=np.float64,
+                       float_precision='round_trip',chunksize=chunk_size)
+    for chunk in reader:
+        data=chunk.to_numpy()
+        yield(data[:,0],data[:,1],data[:,2])
 
-    for i in range(len(data)):
-        if data[i] == '\n':
-            continue
 
-        info=data[i].split()
-        lon.append(float(info[0]))
-        lat.append(float(info[1]))
-        value.append(float(info[2]))
-    return(lon,lat,value)
-    
-    
-def Write_data(filename,lon,lat,value1,value2):
-    with open(filename, 'w') as g:
-        for i in range (len(lon)):
+def Cache_path(filename):
+    return(filename+'.cache.npy')
 
-            g.write('%11.7f  %10.7f' % (lon[i],lat[i]))
-            g.write('%8.4f  %8.4f\n' % (value1[i],value2[i]))
 
+def Read_data(filename,cache=False):
+    # A binary cache next to the XYZ file makes repeat runs on the same survey load instantly
+    cache_file=Cache_path(filename)
+    if cache and os.path.exists(cache_file) and os.path.getmtime(cache_file)>=os.path.getmtime(filename):
+        data=np.load(cache_file,mmap_mode='r')
+        return(data[:,0],data[:,1],data[:,2])
 
-def FindNearest(lon_want,lat_want,lon_model,lat_model,value1_model,value2_model):           
-    
-    loc_model = list(zip(lon_model,lat_model))
-    loc_want = list(zip(lon_want,lat_want))
-    
-    tmp = distance.cdist(loc_want,loc_model)
-    tmp_ind = distance.cdist(loc_want,loc_model).argmin(axis=1)
+    chunks=[np.column_stack(chunk) for chunk in Read_data_chunks(filename)]
+    data=np.concatenate(chunks) if chunks else np.zeros((0,3))
+    if cache:
+        np.save(cache_file,data)
+    return(data[:,0],data[:,1],data[:,2])
 
-    get_lon = [ lon_model[i] for i in tmp_ind ]
-    get_lat = [ lat_model[i] for i in tmp_ind ]
-    get_value1 = [ value1_model[i] for i in tmp_ind ]
-    get_value2 = [ value2_model[i] for i in tmp_ind ]
+
+def Format_fixed(values,width,decimals):
+    # Vectorized '%{width}.{decimals}f': right-aligned ASCII codes per value, plus the columns each value keeps
+    # (values wider than the field keep more columns, exactly like '%' formatting)
+    values=np.asarray(values,dtype=float)
+    scaled=np.abs(values)*10**decimals
+    with np.errstate(invalid='ignore'):
+        rounded=np.rint(scaled)
+        # Values too close to a rounding tie, too large for int64 or not finite are left to '%' formatting
+        fallback=~(scaled<2.0**62) | (np.abs(scaled-np.floor(scaled)-0.5)<=np.maximum(1e-6,scaled*1e-15))
+    rounded[fallback]=0
+    rounded=rounded.astype(np.int64)
+
+    int_part,frac_part=np.divmod(rounded,10**decimals)
+    if decimals<=9:
+        frac_part=frac_part.astype(np.uint32)
+    negative=np.signbit(values)
+    int_digits=np.ones(len(values),dtype=np.int64)
+    for k in range(1,len(str(int(int_part.max()))) if len(values) else 1):
+        int_digits+=int_part>=10**k
+    if len(values) and int_part.max()<2**32:
+        int_part=int_part.astype(np.uint32)
+    needed=np.maximum(width,negative+int_digits+1+decimals)
+    field=int(needed.max()) if len(values) else width
+
+    # Built column by column (transposed), peeling one digit per divmod
+    chars=np.empty((field,len(values)),dtype=np.uint8)
+    remainder=frac_part
+    for k in range(decimals):
+        remainder,digit=np.divmod(remainder,10)
+        chars[field-1-k]=digit+ord('0')
+    chars[field-1-decimals]=ord('.')
+    remainder=int_part
+    for k in range(field-1-decimals):
+        remainder,digit=np.divmod(remainder,10)
+        chars[field-2-decimals-k]=np.where(k<int_digits,digit+ord('0'),
+                                           np.where(negative&(k==int_digits),ord('-'),ord(' ')))
+    keep=np.arange(field)>=field-needed[:,np.newaxis]
+    return(chars.T,keep,fallback)
+
+
+def Write_data(filename,lon,lat,value1,value2,mode='w',chunk_size=1000000):
+    # Same layout as '%11.7f  %10.7f' + '%8.4f  %8.4f\n', built as byte arrays instead of per-line writes
+    with open(filename,mode+'b') as g:
+        for start in range(0,len(lon),chunk_size):
+            stop=start+chunk_size
+            fields=[Format_fixed(lon[start:stop],11,7),Format_fixed(lat[start:stop],10,7),
+                    Format_fixed(value1[start:stop],8,4),Format_fixed(value2[start:stop],8,4)]
+            rows=len(fields[0][0])
+            spacer=np.full((rows,2),ord(' '),dtype=np.uint8)
+            newline=np.full((rows,1),ord('\n'),dtype=np.uint8)
+            lines=np.hstack([fields[0][0],spacer,fields[1][0],fields[2][0],spacer,fields[3][0],newline])
+            keep=np.hstack([fields[0][1],spacer>0,fields[1][1],fields[2][1],spacer>0,fields[3][1],newline>0])
+            fallback=fields[0][2]|fields[1][2]|fields[2][2]|fields[3][2]
+
+            if not fallback.any() and keep.all():
+                g.write(lines.tobytes())
+                continue
+
+            # Selecting the kept columns row by row gives the variable-length lines back to back
+            previous=0
+            for i in np.flatnonzero(fallback):
+                g.write(lines[previous:i][keep[previous:i]].tobytes())
+                g.write(('%11.7f  %10.7f' % (lon[start+i],lat[start+i])).encode())
+                g.write(('%8.4f  %8.4f\n' % (value1[start+i],value2[start+i])).encode())
+                previous=i+1
+            g.write(lines[previous:][keep[previous:]].tobytes())
+
+
+def LonLat_to_ECEF(lon,lat):
+    # Unit-sphere Earth-centred coordinates: the chord length grows with the great-circle
+    # (haversine) distance, so the nearest node in 3D is the nearest node on the sphere
+    lon_rad=np.radians(np.asarray(lon,dtype=float))
+    lat_rad=np.radians(np.asarray(lat,dtype=float))
+    return(np.column_stack((np.cos(lat_rad)*np.cos(lon_rad),
+                            np.cos(lat_rad)*np.sin(lon_rad),
+                            np.sin(lat_rad))))
+
+
+def Model_points(lon,lat,geodetic=False):
+    if geodetic:
+        return(LonLat_to_ECEF(lon,lat))
+    return(np.column_stack((np.asarray(lon,dtype=float),np.asarray(lat,dtype=float))))
+
+
+def Build_tree(lon_model,lat_model,geodetic=False):
+    # Build the model tree once, it can be reused for every survey
+    return(cKDTree(Model_points(lon_model,lat_model,geodetic)))
+
+
+def Nearest_index(tree,lon_want,lat_want,geodetic=False,chunk_size=1000000,workers=1):
+    lon_want=np.asarray(lon_want,dtype=float)
+    lat_want=np.asarray(lat_want,dtype=float)
+    tmp_ind=np.empty(len(lon_want),dtype=np.intp)
+
+    # Query in chunks so the temporary point arrays stay small
+    for start in range(0,len(lon_want),chunk_size):
+        stop=start+chunk_size
+        _,tmp_ind[start:stop]=tree.query(Model_points(lon_want[start:stop],lat_want[start:stop],geodetic),workers=workers)
+    return(tmp_ind)
+
+
+def FindNearest(lon_want,lat_want,lon_model,lat_model,value1_model,value2_model,tree=None,geodetic=False,chunk_size=1000000):
+
+    lon_model=np.asarray(lon_model,dtype=float)
+    lat_model=np.asarray(lat_model,dtype=float)
+    if tree is None:
+        tree=Build_tree(lon_model,lat_model,geodetic)
+
+    tmp_ind=Nearest_index(tree,lon_want,lat_want,geodetic,chunk_size)
+
+    get_lon=lon_model[tmp_ind]
+    get_lat=lat_model[tmp_ind]
+    get_value1=np.asarray(value1_model,dtype=float)[tmp_ind]
+    get_value2=np.asarray(value2_model,dtype=float)[tmp_ind]
 
     return(get_lon,get_lat,get_value1,get_value2)
 
 
 
+def Weights_nearest(tree,lon_want,lat_want,n_model,geodetic=False,chunk_size=1000000):
+    tmp_ind=Nearest_index(tree,lon_want,lat_want,geodetic,chunk_size)
+    return(sparse.csr_matrix((np.ones(len(tmp_ind)),tmp_ind,np.arange(len(tmp_ind)+1)),shape=(len(tmp_ind),n_model)))
+
+
+def Weights_idw(tree,lon_want,lat_want,n_model,k=4,power=2,geodetic=False,chunk_size=1000000):
+    # Inverse distance weights of the k nearest model nodes (a node hit exactly takes all the weight)
+    lon_want=np.asarray(lon_want,dtype=float)
+    lat_want=np.asarray(lat_want,dtype=float)
+    k=min(k,n_model)
+    weights=np.empty((len(lon_want),k))
+    tmp_ind=np.empty((len(lon_want),k),dtype=np.intp)
+
+    for start in range(0,len(lon_want),chunk_size):
+        stop=start+chunk_size
+        dist,ind=tree.query(Model_points(lon_want[start:stop],lat_want[start:stop],geodetic),k=k,workers=-1)
+        dist=dist.reshape(-1,k)
+        tmp_ind[start:stop]=ind.reshape(-1,k)
+        with np.errstate(divide='ignore'):
+            w=1.0/dist**power
+        exact=dist[:,0]==0
+        w[exact]=0
+        w[exact,0]=1
+        weights[start:stop]=w/w.sum(axis=1,keepdims=True)
+
+    return(sparse.csr_matrix((weights.ravel(),tmp_ind.ravel(),np.arange(0,weights.size+1,k)),shape=(len(lon_want),n_model)))
+
+
+def Weights_bilinear(lon_model,lat_model,lon_want,lat_want):
+    # Bilinear weights of the four corners of the model grid cell holding each point (clamped at the grid edge)
+    lon_model=np.asarray(lon_model,dtype=float)
+    lat_model=np.asarray(lat_model,dtype=float)
+    lon_want=np.asarray(lon_want,dtype=float)
+    lat_want=np.asarray(lat_want,dtype=float)
+
+    lon_nodes=np.unique(lon_model)
+    lat_nodes=np.unique(lat_model)
+    if len(lon_nodes)<2 or len(lat_nodes)<2 or len(lon_nodes)*len(lat_nodes)!=len(lon_model):
+        raise ValueError('Bilinear interpolation needs a complete regular lon/lat grid model')
+    node_index=np.full((len(lat_nodes),len(lon_nodes)),-1,dtype=np.intp)
+    node_index[np.searchsorted(lat_nodes,lat_model),np.searchsorted(lon_nodes,lon_model)]=np.arange(len(lon_model))
+    if (node_index<0).any():
+        raise ValueError('Bilinear interpolation needs a complete regular lon/lat grid model')
+
+    i=np.clip(np.searchsorted(lon_nodes,lon_want)-1,0,len(lon_nodes)-2)
+    j=np.clip(np.searchsorted(lat_nodes,lat_want)-1,0,len(lat_nodes)-2)
+    tx=np.clip((lon_want-lon_nodes[i])/(lon_nodes[i+1]-lon_nodes[i]),0,1)
+    ty=np.clip((lat_want-lat_nodes[j])/(lat_nodes[j+1]-lat_nodes[j]),0,1)
+
+    tmp_ind=np.column_stack((node_index[j,i],node_index[j,i+1],node_index[j+1,i],node_index[j+1,i+1]))
+    weights=np.column_stack(((1-tx)*(1-ty),tx*(1-ty),(1-tx)*ty,tx*ty))
+    return(sparse.csr_matrix((weights.ravel(),tmp_ind.ravel(),np.arange(0,weights.size+1,4)),shape=(len(lon_want),len(lon_model))))
+
+
+def Model_weights(lon_model,lat_model,lon_want,lat_want,method='nearest',k=4,power=2,geodetic=False,cache_dir=None):
+    # Sparse (survey points x model nodes) weights; model values are then interpolated with one product.
+    # The cache key only depends on the point and node positions, so a new MSS/ISLW release on the same
+    # nodes reuses the weights without a new spatial search.
+    lon_model=np.ascontiguousarray(lon_model,dtype=float)
+    lat_model=np.ascontiguousarray(lat_model,dtype=float)
+    lon_want=np.ascontiguousarray(lon_want,dtype=float)
+    lat_want=np.ascontiguousarray(lat_want,dtype=float)
+
+    cache_file=None
+    if cache_dir:
+        key=hashlib.sha1(repr((method,k,power,geodetic)).encode())
+        for array in (lon_model,lat_model,lon_want,lat_want):
+            key.update(array.tobytes())
+        cache_file=os.path.join(cache_dir,'weights_%s_%s.npz' % (method,key.hexdigest()))
+        if os.path.exists(cache_file):
+            return(sparse.load_npz(cache_file))
+
+    if method=='bilinear':
+        weights=Weights_bilinear(lon_model,lat_model,lon_want,lat_want)
+    elif method=='idw':
+        weights=Weights_idw(Build_tree(lon_model,lat_model,geodetic),lon_want,lat_want,len(lon_model),k,power,geodetic)
+    else:
+        weights=Weights_nearest(Build_tree(lon_model,lat_model,geodetic),lon_want,lat_want,len(lon_model),geodetic)
+
+    if cache_file:
+        os.makedirs(cache_dir,exist_ok=True)
+        sparse.save_npz(cache_file,weights)
+    return(weights)
+
+
+
+
+# Model trees and values shared with the worker processes (inherited on fork, pickled once per worker otherwise)
+model={}
+
+def Init_worker(mss_tree,mss,islw_tree,islw,geodetic):
+    model['mss_tree']=mss_tree
+    model['mss']=mss
+    model['islw_tree']=islw_tree
+    model['islw']=islw
+    model['geodetic']=geodetic
+
+
+def Correct_chunk(chunk):
+    lon,lat,depth=chunk
+    initial_depth=model['mss'][Nearest_index(model['mss_tree'],lon,lat,model['geodetic'])]
+    final_depth=model['islw'][Nearest_index(model['islw_tree'],lon,lat,model['geodetic'])]
+    return(depth+final_depth-initial_depth)
+
+
+def Tide_correction(lon,lat,depth,lon_mss,lat_mss,mss,lon_islw,lat_islw,islw,workers=cpu_count(),chunk_size=1000000,geodetic=False,
+                    method='nearest',k=4,power=2,weights_cache=None):
+    lon=np.asarray(lon,dtype=float)
+    lat=np.asarray(lat,dtype=float)
+    depth=np.asarray(depth,dtype=float)
+
+    # Interpolated models (or cached weights) are applied as sparse matrix-vector products
+    if method!='nearest' or weights_cache:
+        mss_weights=Model_weights(lon_mss,lat_mss,lon,lat,method,k,power,geodetic,weights_cache)
+        islw_weights=Model_weights(lon_islw,lat_islw,lon,lat,method,k,power,geodetic,weights_cache)
+        return(depth+islw_weights@np.asarray(islw,dtype=float)-mss_weights@np.asarray(mss,dtype=float))
+
+    # Build each model tree once and share it with every chunk
+    model_args=(Build_tree(lon_mss,lat_mss,geodetic),np.asarray(mss,dtype=float),
+                Build_tree(lon_islw,lat_islw,geodetic),np.asarray(islw,dtype=float),geodetic)
+    chunks=[(lon[i:i+chunk_size],lat[i:i+chunk_size],depth[i:i+chunk_size]) for i in range(0,len(lon),chunk_size)]
+
+    if workers>1 and len(chunks)>1:
+        with Pool(processes=min(workers,len(chunks)),initializer=Init_worker,initargs=model_args) as pool:
+            # map keeps the chunk order, so the corrected depths line up with the input points
+            new_depth=pool.map(Correct_chunk,chunks)
+    else:
+        Init_worker(*model_args)
+        new_depth=[Correct_chunk(chunk) for chunk in chunks]
+
+    return(np.concatenate(new_depth) if new_depth else np.zeros(0))
+
+
+def Tide_correction_stream(survey_file,output_file,lon_mss,lat_mss,mss,lon_islw,lat_islw,islw,block_size=1000000,
+                           geodetic=False,method='nearest',k=4,power=2):
+    # Out-of-core correction: the survey is read, corrected and appended block by block,
+    # so peak memory is set by the block size and the in-memory model index
+    models=[]
+    for lon_model,lat_model,values in ((lon_mss,lat_mss,mss),(lon_islw,lat_islw,islw)):
+        lon_model=np.asarray(lon_model,dtype=float)
+        lat_model=np.asarray(lat_model,dtype=float)
+        tree=None if method=='bilinear' else Build_tree(lon_model,lat_model,geodetic)
+        models.append((lon_model,lat_model,np.asarray(values,dtype=float),tree))
+
+    def Model_values(lon,lat,lon_model,lat_model,values,tree):
+        if method=='bilinear':
+            return(Weights_bilinear(lon_model,lat_model,lon,lat)@values)
+        if method=='idw':
+            return(Weights_idw(tree,lon,lat,len(values),k,power,geodetic)@values)
+        return(values[Nearest_index(tree,lon,lat,geodetic,workers=-1)])
+
+    open(output_file,'w').close()
+    total=0
+    start_time=time.perf_counter()
+    for lon,lat,depth in Read_data_chunks(survey_file,block_size):
+        initial_depth=Model_values(lon,lat,*models[0])
+        final_depth=Model_values(lon,lat,*models[1])
+        Write_data(output_file,lon,lat,depth,depth+final_depth-initial_depth,mode='a')
+
+        total+=len(lon)
+        elapsed=time.perf_counter()-start_time
+        print('%d points corrected, %.0f points/s' % (total,total/elapsed if elapsed>0 else 0))
+
+    elapsed=time.perf_counter()-start_time
+    return(total,total/elapsed if elapsed>0 else 0.0)
+
 
-[lon,lat,depth]=Read_data('.../test.xyz')
-[lon_tide1,lat_tide1,mss]=Read_data('.../mss.xyz')
-[lon_tide2,lat_tide2,islw]=Read_data('.../ISLW.xyz')
+def main():
+    parser=argparse.ArgumentParser(description='Tide correction of survey depths: depth + ISLW - MSS, from the nearest or interpolated model nodes.')
+    parser.add_argument('survey',help='survey XYZ file (lon lat depth)')
+    parser.add_argument('mss',help='MSS model XYZ file (lon lat value)')
+    parser.add_argument('islw',help='ISLW model XYZ file (lon lat value)')
+    parser.add_argument('output',help='output file (lon lat depth corrected_depth)')
+    parser.add_argument('--workers',type=int,default=None,help='number of worker processes (default: all cores, not used with --stream)')
+    parser.add_argument('--chunk-size',type=int,default=1000000,help='survey points per chunk')
+    parser.add_argument('--geodetic',action='store_true',help='nearest node on the sphere (ECEF) instead of planar lon/lat')
+    parser.add_argument('--cache',action='store_true',help='keep a binary .cache.npy copy of every input for fast re-runs')
+    parser.add_argument('--method',choices=['nearest','idw','bilinear'],default='nearest',help='model interpolation')
+    parser.add_argument('--k',type=int,default=4,help='number of neighbours for idw')
+    parser.add_argument('--power',type=float,default=2,help='distance power for idw')
+    parser.add_argument('--weights-cache',default=None,help='directory caching the interpolation weights of each survey (not used with --stream)')
+    parser.add_argument('--stream',action='store_true',help='read, correct and write the survey in blocks of --chunk-size points')
+    args=parser.parse_args()
+    # The streamed path corrects one block at a time in this process, so it has no pool and no per-survey weights
+    if args.stream and (args.workers is not None or args.weights_cache):
+        parser.error('--workers and --weights-cache cannot be used with --stream')
+    workers=cpu_count() if args.workers is None else args.workers
 
-#tide1_dict={"lon":lon_tide1, "lat":lat_tide1, "tide":mss}
-#tide2_dict={"lon":lon_tide2, "lat":lat_tide2, "tide":mss}
-#tide1_df = pd.DataFrame(tide1_dict)
-#tide2_df = pd.DataFrame(tide2_dict)
-initial_depth= np.zeros(len(lon))
-final_depth= np.zeros(len(lon))
+    [lon_tide1,lat_tide1,mss]=Read_data(args.mss,cache=args.cache)
+    [lon_tide2,lat_tide2,islw]=Read_data(args.islw,cache=args.cache)
 
+    if args.stream:
+        total,rate=Tide_correction_stream(args.survey,args.output,lon_tide1,lat_tide1,mss,lon_tide2,lat_tide2,islw,
+                                          block_size=args.chunk_size,geodetic=args.geodetic,
+                                          method=args.method,k=args.k,power=args.power)
+        print('Corrected %d points (%.0f points/s), output saved to %s' % (total,rate,args.output))
+        return
 
-pool=Pool(processes=cpu_count())
-[lon_i,lat_i,initial_depth,final_depth]=pool.map(FindNearest2,[lon,lat,lon_tide1,lat_tide1,mss,islw])
-pool.close()
-#[lon_i,lat_i,initial_depth,final_depth]=FindNearest(lon,lat,lon_tide1,lat_tide1,mss,islw)
-new_depth=np.array(depth)+np.array(final_depth)-np.array(initial_depth)
+    [lon,lat,depth]=Read_data(args.survey,cache=args.cache)
 
-Write_data[lon,lat,depth,new_depth]
+    new_depth=Tide_correction(lon,lat,depth,lon_tide1,lat_tide1,mss,lon_tide2,lat_tide2,islw,
+                              workers=workers,chunk_size=args.chunk_size,geodetic=args.geodetic,
+                              method=args.method,k=args.k,power=args.power,weights_cache=args.weights_cache)
 
+    Write_data(args.output,lon,lat,depth,new_depth)
+    print('Corrected %d points, output saved to %s' % (len(new_depth),args.output))
 
 
+if __name__ == '__main__':
+    main()
@@ -5,8 +5,14 @@ Created on Wed Mar  4 11:01:35 2020
 @author: Ming-Yi Hsu
 """
 
+import os
+from multiprocessing import Pool
+from time import perf_counter
+import matplotlib
+matplotlib.use('Agg')
 from matplotlib import pyplot as plt
 import matplotlib.animation as animation
+from matplotlib.ticker import MaxNLocator
 import pandas as pd
 import numpy as np
 import netCDF4 as nc
@@ -14,74 +20,233 @@ import seaborn as sns
 import cartopy.crs as ccrs
 from cartopy.mpl.ticker import LongitudeFormatter, LatitudeFormatter
 from cartopy.util import add_cyclic_point
-sns.set_context('talk', font_scale=1.2) 
+sns.set_context('talk', font_scale=1.2)
 
 
 #讀取檔案位置
 ncf_data = 'D:/nc/GRCTellus.JPL.200204_201911.GLO.RL06M.MSCNv02CRI.nc'
-data_JPL = nc.Dataset(ncf_data)
-print(data_JPL)
-#確認nc檔案內容
+#png輸出位置及解析度
+output_dir = 'D:/nc/'
+frame_dpi = 300
+#平行繪圖的程序數
+workers = os.cpu_count()
+#動畫檔案 (.mp4 需要 ffmpeg, .gif 使用 Pillow)
+animation_file = 'D:/nc/lwe_thickness.gif'
+animation_fps = 4
+animation_width = 1200
+#逐段讀取的時間長度 (一次讀入的時間數)
+time_chunk = 12
+
+
+def read_frame(variable, i, lon=None):
+    #只讀取第i個時間的資料 (遮罩值設為NaN)，有給經度時逐張加上循環經度
+    frame = np.ma.filled(variable[i].astype(float), np.nan)
+    if lon is None:
+        return frame
+    frame, _ = add_cyclic_point(frame, coord=lon)
+    return frame
+
+
+def iter_time_chunks(variable, chunk_size, rows=None):
+    #依時間分段讀取 (time,lat,lon) 變數，可只讀取部分緯度列
+    rows = slice(None) if rows is None else rows
+    for start in range(0, variable.shape[0], chunk_size):
+        yield start, np.ma.filled(variable[start:start+chunk_size, rows, :].astype(float), np.nan)
+
+
+def band_statistics(args):
+    #單一緯度帶的串流統計：筆數、總和、最大最小值及線性趨勢所需的累加量
+    ncf_path, name, row_start, row_end, chunk_size = args
+    with nc.Dataset(ncf_path) as dataset:
+        variable = dataset.variables[name]
+        years = dataset.variables['time'][:].data / 365.25
+        years = years - years.mean()
+
+        shape = (row_end - row_start, variable.shape[2])
+        count = np.zeros(shape)
+        sum_y = np.zeros(shape)
+        sum_t = np.zeros(shape)
+        sum_tt = np.zeros(shape)
+        sum_ty = np.zeros(shape)
+        low = np.full(shape, np.inf)
+        high = np.full(shape, -np.inf)
+        for start, block in iter_time_chunks(variable, chunk_size, slice(row_start, row_end)):
+            valid = ~np.isnan(block)
+            t = years[start:start+len(block), np.newaxis, np.newaxis] * valid
+            y = np.where(valid, block, 0)
+            count += valid.sum(axis=0)
+            sum_y += y.sum(axis=0)
+            sum_t += t.sum(axis=0)
+            sum_tt += (t * t).sum(axis=0)
+            sum_ty += (t * y).sum(axis=0)
+            low = np.minimum(low, np.where(valid, block, np.inf).min(axis=0))
+            high = np.maximum(high, np.where(valid, block, -np.inf).max(axis=0))
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(count > 0, sum_y / count, np.nan)
+        denominator = count * sum_tt - sum_t ** 2
+        trend = np.where((count > 1) & (denominator > 0), (count * sum_ty - sum_t * sum_y) / denominator, np.nan)
+    low[count == 0] = np.nan
+    high[count == 0] = np.nan
+    return dict(count=count, mean=mean, min=low, max=high, trend=trend)
+
+
+def time_statistics(ncf_path, name, chunk_size=12, workers=1):
+    #時間平均、最大最小值及每年趨勢；各程序負責一個緯度帶，依時間分段串流讀取
+    with nc.Dataset(ncf_path) as dataset:
+        rows = dataset.variables[name].shape[1]
+    bands = np.array_split(np.arange(rows), max(1, min(workers, rows)))
+    tasks = [(ncf_path, name, band[0], band[-1] + 1, chunk_size) for band in bands if len(band)]
+
+    if workers > 1 and len(tasks) > 1:
+        with Pool(processes=len(tasks)) as pool:
+            results = pool.map(band_statistics, tasks)
+    else:
+        results = [band_statistics(task) for task in tasks]
+    return {key: np.concatenate([result[key] for result in results]) for key in results[0]}
+
+
+def iter_anomaly(variable, mean, chunk_size=12):
+    #距平 (減去時間平均) 以時間分段產生，不需讀入整個資料
+    for start, block in iter_time_chunks(variable, chunk_size):
+        for i, frame in enumerate(block - mean):
+            yield start + i, frame
+
+
+#每個程序的繪圖物件
+renderer = {}
+
+
+def init_renderer(ncf_path, levels, out_dir, dpi):
+    #每個程序只建立一次圖框、座標軸及海岸線，之後每張圖只更新等值線
+    dataset = nc.Dataset(ncf_path)
+    lat = dataset.variables['lat'][:].data
+    lon = dataset.variables['lon'][:].data
+    _, cycle_lon = add_cyclic_point(np.zeros(len(lon)), coord=lon)
+    cycle_LON, cycle_LAT = np.meshgrid(cycle_lon, lat)
+
+    #設定投影
+    projection = ccrs.PlateCarree()
+    fig, ax = plt.subplots(figsize=(12, 5), subplot_kw=dict(projection=projection))
 
+    #設定坐標軸
+    ax.set_xticks(np.arange(-180, 181, 60), crs = projection)
+    ax.set_yticks(np.arange(-90, 91, 30), crs = projection)
+    lon_formatter = LongitudeFormatter(number_format='.0f',degree_symbol='', dateline_direction_label=True)
+    lat_formatter = LatitudeFormatter(number_format='.0f', degree_symbol='')
+    ax.xaxis.set_major_formatter(lon_formatter)
+    ax.yaxis.set_major_formatter(lat_formatter)
+    #設定海岸線
+    ax.coastlines()
+    ax.grid(True)
 
+    renderer.update(dataset=dataset, lon=lon, LON=cycle_LON, LAT=cycle_LAT, fig=fig, ax=ax,
+                    levels=levels, output_dir=out_dir, dpi=dpi, contour=None, colorbar=None)
 
-#取得變數名稱及數量
-all_vars = data_JPL.variables.keys()
-print(all_vars)
-print(len(all_vars))
 
+def render_frame(i):
+    #只讀取第i個時間的資料，並逐張加上循環經度
+    think = read_frame(renderer['dataset'].variables['lwe_thickness'], i, renderer['lon'])
 
-#取得變數資訊
-all_vars_info = data_JPL.variables.items() 
-type(all_vars_info)
-all_vars_info = list(all_vars_info)
-print(all_vars_info)
+    if renderer['contour'] is not None:
+        renderer['contour'].remove()
+    renderer['contour'] = renderer['ax'].contourf(renderer['LON'], renderer['LAT'], think, levels=renderer['levels'])
 
+    #設定colorbar (分級固定，所以只需建立一次)
+    if renderer['colorbar'] is None:
+        renderer['colorbar'] = renderer['fig'].colorbar(renderer['contour'])
 
+    #輸出成png檔案
+    frame_file = os.path.join(renderer['output_dir'], str(i)+'.png')
+    renderer['fig'].savefig(frame_file, dpi=renderer['dpi'], bbox_inches='tight')
+    return frame_file
 
 
-#將nc檔案變數讀取
-lat = data_JPL.variables['lat'][:].data
-lon = data_JPL.variables['lon'][:].data
-uncert  = data_JPL.variables['uncertainty'][:].data
-thickness = data_JPL.variables['lwe_thickness'][:].data
-lat_bound = data_JPL.variables['lat_bounds'][:].data
-lon_bound = data_JPL.variables['lon_bounds'][:].data
-time = lon_bound = data_JPL.variables['time'][:].data
-length = len(time)
-#'uncertainty' 及 'lwe_thickness' 為包含經緯度的3維資料，資料內容為(time,lat,lon)
+def close_renderer():
+    plt.close(renderer['fig'])
+    renderer['dataset'].close()
 
 
+def render_frames(ncf_path, length, levels, out_dir, dpi, workers=1):
+    #將各時間的圖分配給多個程序繪製，回傳png檔案及每秒張數
+    start = perf_counter()
+    if workers > 1 and length > 1:
+        with Pool(processes=min(workers, length), initializer=init_renderer, initargs=(ncf_path, levels, out_dir, dpi)) as pool:
+            frame_files = list(pool.imap(render_frame, range(length)))
+    else:
+        init_renderer(ncf_path, levels, out_dir, dpi)
+        frame_files = [render_frame(i) for i in range(length)]
+        close_renderer()
+    return frame_files, length / (perf_counter() - start)
 
-cycle_think, cycle_lon = add_cyclic_point(thickness, coord=lon)
-cycle_LON, cycle_LAT = np.meshgrid(cycle_lon, lat)
 
-#設定投影
-projection = ccrs.PlateCarree()
+def write_animation(frame_files, output_file, fps, width):
+    #依序讀入png組成動畫，一次只保留一張圖在記憶體
+    first = plt.imread(frame_files[0])
+    height = width * first.shape[0] / first.shape[1]
+    fig = plt.figure(figsize=(width / 100, height / 100), dpi=100)
+    ax = fig.add_axes([0, 0, 1, 1])
+    ax.axis('off')
+    image = ax.imshow(first)
 
-#資料輸出成png檔案
-ims=[]    
+    def update(frame_file):
+        image.set_data(plt.imread(frame_file))
+        return [image]
 
-for i in range(0,length):
-    think=cycle_think[i,:,:]
-    fig, ax = plt.subplots(figsize=(12, 5), subplot_kw=dict(projection=projection))
-    con = ax.contourf(cycle_LON, cycle_LAT,think)
+    writer = animation.FFMpegWriter(fps=fps) if output_file.lower().endswith('.mp4') else animation.PillowWriter(fps=fps)
+    anim = animation.FuncAnimation(fig, update, frames=frame_files, cache_frame_data=False)
+    anim.save(output_file, writer=writer, dpi=100)
+    plt.close(fig)
 
-    #設定坐標軸
-    ax.set_xticks(np.arange(-180, 181, 60), crs = projection)
-    ax.set_yticks(np.arange(-90, 91, 30), crs = projection)
-    lon_formatter = LongitudeFormatter(number_format='.0f',degree_symbol='', dateline_direction_label=True)
-    lat_formatter = LatitudeFormatter(number_format='.0f', degree_symbol='')
-    ax.xaxis.set_major_formatter(lon_formatter)
-    ax.yaxis.set_major_formatter(lat_formatter)
-    #設定海岸線
-    ax.coastlines() 
-    plt.grid(True)
-    #設定colorbar
-    cb = fig.colorbar(con)
-    #cb.set_ticks(np.arange(-500,600, 100))
-    #cb.set_ticklabels(np.arange(-500,600, 100))
-    ims.append(con)
-    #輸出成png檔案
-    fig.savefig('D:/nc/'+str(i)+'.png', dpi=300, bbox_inches='tight')
-    plt.show()
+
+if __name__ == '__main__':
+    data_JPL = nc.Dataset(ncf_data)
+    print(data_JPL)
+    #確認nc檔案內容
+
+
+
+    #取得變數名稱及數量
+    all_vars = data_JPL.variables.keys()
+    print(all_vars)
+    print(len(all_vars))
+
+
+    #取得變數資訊
+    all_vars_info = data_JPL.variables.items()
+    type(all_vars_info)
+    all_vars_info = list(all_vars_info)
+    print(all_vars_info)
+
+
+
+
+    #將nc檔案變數讀取
+    lat = data_JPL.variables['lat'][:].data
+    lon = data_JPL.variables['lon'][:].data
+    lat_bound = data_JPL.variables['lat_bounds'][:].data
+    lon_bound = data_JPL.variables['lon_bounds'][:].data
+    time = data_JPL.variables['time'][:].data
+    length = len(time)
+    #'uncertainty' 及 'lwe_thickness' 為包含經緯度的3維資料，資料內容為(time,lat,lon)
+    #兩者只保留變數物件，需要時才依時間讀取 (read_frame / iter_time_chunks)
+    uncert = data_JPL.variables['uncertainty']
+    thickness = data_JPL.variables['lwe_thickness']
+
+
+
+    #串流計算時間平均、最大最小值及趨勢 (單位/年)
+    stats = time_statistics(ncf_data, 'lwe_thickness', time_chunk, workers)
+    print('lwe_thickness mean: %.3f ~ %.3f, trend: %.3f ~ %.3f per year'
+          % (np.nanmin(stats['mean']), np.nanmax(stats['mean']), np.nanmin(stats['trend']), np.nanmax(stats['trend'])))
+
+    #固定等值線分級，讓每一張圖的顏色可以互相比較
+    levels = MaxNLocator(nbins=10).tick_values(np.nanmin(stats['min']), np.nanmax(stats['max']))
+
+    #資料輸出成png檔案
+    frame_files, rate = render_frames(ncf_data, length, levels, output_dir, frame_dpi, workers)
+    print('Rendered %d frames (%.2f frames/s)' % (length, rate))
+
+    #組成動畫
+    write_animation(frame_files, animation_file, animation_fps, animation_width)
+    print('Animation saved to %s' % animation_file)
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+Per-pixel trend and seasonal analysis of the GRACE (time,lat,lon) cubes read by netCDF.py
+"""
+
+import numpy as np
+import netCDF4 as nc
+import rasterio
+from rasterio.transform import from_origin
+from netCDF import iter_time_chunks
+
+
+#讀取檔案位置及變數
+ncf_data = 'D:/nc/GRCTellus.JPL.200204_201911.GLO.RL06M.MSCNv02CRI.nc'
+variable_name = 'lwe_thickness'
+#輸出檔案 (netCDF 及 GeoTIFF)
+output_nc = 'D:/nc/lwe_thickness_trend.nc'
+output_tif = 'D:/nc/lwe_thickness_trend.tif'
+#一次處理的緯度列數
+rows_per_chunk = 60
+
+#輸出的分析結果
+result_names = ['trend', 'annual_amplitude', 'semiannual_amplitude', 'residual_rms', 'count']
+
+
+def design_matrix(time):
+    #常數、線性趨勢、年週期及半年週期 (time 單位為天，換算成年並以中間時間為原點)
+    years = np.asarray(time, dtype=float) / 365.25
+    t = years - years.mean()
+    return np.column_stack([np.ones_like(t), t,
+                            np.cos(2 * np.pi * years), np.sin(2 * np.pi * years),
+                            np.cos(4 * np.pi * years), np.sin(4 * np.pi * years)])
+
+
+def fit_pixels(A, Y):
+    #A: (time, 6) 設計矩陣, Y: (time, pixels) 觀測值 (NaN 為缺值)，回傳係數、殘差RMS及有效筆數
+    valid = ~np.isnan(Y)
+    count = valid.sum(axis=0)
+    coef = np.full((A.shape[1], Y.shape[1]), np.nan)
+
+    #完整的像素共用同一個設計矩陣，一次 lstsq 解出
+    complete = count == len(A)
+    if complete.any():
+        coef[:, complete] = np.linalg.lstsq(A, Y[:, complete], rcond=None)[0]
+
+    #有缺值的像素以加權正規方程式批次求解 (每個像素一個 6x6 系統)
+    partial = np.flatnonzero(~complete & (count > A.shape[1]))
+    if len(partial):
+        W = valid[:, partial].astype(float)
+        y = np.where(valid[:, partial], Y[:, partial], 0)
+        normal = np.einsum('tp,tk,tl->pkl', W, A, A)
+        rhs = np.einsum('tp,tk->pk', W * y, A)
+        solvable = np.linalg.matrix_rank(normal) == A.shape[1]
+        coef[:, partial[solvable]] = np.linalg.solve(normal[solvable], rhs[solvable][..., np.newaxis])[..., 0].T
+
+    residual = Y - A @ coef
+    with np.errstate(invalid='ignore', divide='ignore'):
+        rms = np.sqrt(np.nansum(residual ** 2, axis=0) / count)
+    rms[np.isnan(coef[0])] = np.nan
+    return coef, rms, count
+
+
+def trend_analysis(ncf_path, name, chunk_rows=60):
+    #依緯度分段讀取全部時間，批次計算每個像素的趨勢、年及半年振幅與殘差RMS
+    with nc.Dataset(ncf_path) as dataset:
+        variable = dataset.variables[name]
+        A = design_matrix(dataset.variables['time'][:].data)
+        n_time, n_lat, n_lon = variable.shape
+        results = {key: np.full((n_lat, n_lon), np.nan) for key in result_names}
+
+        for row_start in range(0, n_lat, chunk_rows):
+            rows = slice(row_start, min(row_start + chunk_rows, n_lat))
+            _, block = next(iter_time_chunks(variable, n_time, rows))
+            coef, rms, count = fit_pixels(A, block.reshape(n_time, -1))
+
+            shape = block.shape[1:]
+            results['trend'][rows] = coef[1].reshape(shape)
+            results['annual_amplitude'][rows] = np.hypot(coef[2], coef[3]).reshape(shape)
+            results['semiannual_amplitude'][rows] = np.hypot(coef[4], coef[5]).reshape(shape)
+            results['residual_rms'][rows] = rms.reshape(shape)
+            results['count'][rows] = count.reshape(shape)
+    return results
+
+
+def write_netcdf(output_path, ncf_path, name, results):
+    #輸出成 (lat,lon) 的 netCDF，經緯度及單位沿用原始檔案
+    with nc.Dataset(ncf_path) as source, nc.Dataset(output_path, 'w') as target:
+        units = getattr(source.variables[name], 'units', '')
+        for dim in ('lat', 'lon'):
+            target.createDimension(dim, len(source.variables[dim]))
+            coordinate = target.createVariable(dim, 'f8', (dim,))
+            coordinate[:] = source.variables[dim][:]
+            coordinate.units = getattr(source.variables[dim], 'units', '')
+        for key, values in results.items():
+            variable = target.createVariable(key, 'f4', ('lat', 'lon'), fill_value=np.float32(np.nan))
+            variable[:] = values
+            variable.units = {'trend': units + '/year', 'count': '1'}.get(key, units)
+
+
+def write_geotiff(output_path, ncf_path, results):
+    #輸出成多波段 GeoTIFF (EPSG:4326)，北方在上
+    with nc.Dataset(ncf_path) as source:
+        lat = source.variables['lat'][:].data
+        lon = source.variables['lon'][:].data
+    flip = lat[0] < lat[-1]
+    dlon, dlat = abs(lon[1] - lon[0]), abs(lat[1] - lat[0])
+    transform = from_origin(lon.min() - dlon / 2, lat.max() + dlat / 2, dlon, dlat)
+
+    with rasterio.open(output_path, 'w', driver='GTiff', height=len(lat), width=len(lon), count=len(results),
+                       dtype='float32', crs='EPSG:4326', transform=transform, nodata=np.nan) as dst:
+        for band, (key, values) in enumerate(results.items(), start=1):
+            dst.write((values[::-1] if flip else values).astype('float32'), band)
+            dst.set_band_description(band, key)
+
+
+if __name__ == '__main__':
+    results = trend_analysis(ncf_data, variable_name, rows_per_chunk)
+    print('trend: %.3f ~ %.3f per year, annual amplitude: %.3f ~ %.3f'
+          % (np.nanmin(results['trend']), np.nanmax(results['trend']),
+             np.nanmin(results['annual_amplitude']), np.nanmax(results['annual_amplitude'])))
+
+    write_netcdf(output_nc, ncf_data, variable_name, results)
+    write_geotiff(output_tif, ncf_data, results)
+    print('Results saved to %s and %s' % (output_nc, output_tif))
@@ -0,0 +1,166 @@
+# Shared GeoTIFF access for the scripts in this repository.
+# Reads go through windows built from the raster's own blocks, decoded blocks are kept in an LRU cache
+# sized in bytes, uncompressed GeoTIFF blocks are memory-mapped instead of decoded by GDAL, and every
+# reader returns float64 with NaN for nodata (the declared nodata value, -9999 and NaN alike).
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+import rasterio
+from rasterio.crs import CRS
+from rasterio.enums import Interleaving
+from rasterio.windows import Window
+
+
+DEFAULT_CRS = 'EPSG:3826'  # CRS assumed for rasters and vectors without one
+NODATA_SENTINEL = -9999  # Treated as nodata even when the file does not declare it
+CACHE_BYTES = 512 * 1024 ** 2  # Decoded blocks kept in memory, shared by every raster opened in the process
+
+# Decoded blocks keyed by (path, modification time, band, block row, block column), oldest first;
+# the lock makes the cache safe to share between reader threads
+block_cache = {'blocks': OrderedDict(), 'nbytes': 0, 'max_bytes': CACHE_BYTES, 'lock': threading.Lock()}
+byte_orders = {}
+
+
+# CRS of a dataset, or the default CRS when the file has none
+def raster_crs(src, default=DEFAULT_CRS):
+    return src.crs if src.crs else CRS.from_string(default)
+
+
+# Float64 copy of raster values with every kind of nodata set to NaN
+def nodata_to_nan(values, nodata):
+    values = np.array(values, dtype=np.float64)
+    invalid = np.isnan(values) | (values == NODATA_SENTINEL)
+    if nodata is not None and not np.isnan(nodata):
+        invalid |= values == nodata
+    values[invalid] = np.nan
+    return values
+
+
+# Replace NaN with the dataset's nodata value before writing (NaN stays when there is none)
+def fill_nodata(values, nodata):
+    if nodata is None or np.isnan(nodata):
+        return values
+    return np.where(np.isnan(values), nodata, values)
+
+
+def set_cache_size(max_bytes):
+    with block_cache['lock']:
+        block_cache['max_bytes'] = max_bytes
+        trim_cache()
+
+
+def clear_cache():
+    with block_cache['lock']:
+        block_cache['blocks'].clear()
+        block_cache['nbytes'] = 0
+
+
+# Drop the least recently used blocks until the cache fits; called with the lock held
+def trim_cache():
+    blocks = block_cache['blocks']
+    while blocks and block_cache['nbytes'] > block_cache['max_bytes']:
+        _, block = blocks.popitem(last=False)
+        block_cache['nbytes'] -= block.nbytes
+
+
+# Raw block straight from the file when the GeoTIFF is uncompressed and on the local filesystem, otherwise None.
+# GDAL virtual paths (/vsizip/, /vsicurl/, /vsimem/ ...) report block offsets too, but cannot be opened or mapped here.
+def block_memmap(src, band, block_row, block_col, rows, cols):
+    if src.driver != 'GTiff' or src.compression is not None or not os.path.isfile(src.name):
+        return None
+    if src.count > 1 and src.interleaving != Interleaving.band:
+        return None
+
+    offset = src.get_tag_item(f'BLOCK_OFFSET_{block_col}_{block_row}', 'TIFF', bidx=band)
+    size = src.get_tag_item(f'BLOCK_SIZE_{block_col}_{block_row}', 'TIFF', bidx=band)
+    if not offset or not size:
+        return None
+
+    if src.name not in byte_orders:
+        with open(src.name, 'rb') as f:
+            byte_orders[src.name] = '<' if f.read(2) == b'II' else '>'
+    dtype = np.dtype(src.dtypes[band - 1]).newbyteorder(byte_orders[src.name])
+
+    # Tiles are stored padded to the full block, the last strip only holds the remaining rows
+    block_width = src.block_shapes[band - 1][1]
+    stored_rows = int(size) // (block_width * dtype.itemsize)
+    if stored_rows < rows:
+        return None
+    return np.memmap(src.name, dtype=dtype, mode='r', offset=int(offset), shape=(stored_rows, block_width))[:rows, :cols]
+
+
+# One block of a band as float64 with NaN nodata, through the cache; cache=False still uses a cached block
+# but does not add new ones, for data that is read only once
+def read_block(src, block_row, block_col, band=1, cache=True):
+    key = (src.name, os.path.getmtime(src.name) if os.path.exists(src.name) else None, band, block_row, block_col)
+    blocks = block_cache['blocks']
+    with block_cache['lock']:
+        if key in blocks:
+            blocks.move_to_end(key)
+            return blocks[key]
+
+    block_height, block_width = src.block_shapes[band - 1]
+    row_off, col_off = block_row * block_height, block_col * block_width
+    rows, cols = min(block_height, src.height - row_off), min(block_width, src.width - col_off)
+
+    raw = block_memmap(src, band, block_row, block_col, rows, cols)
+    if raw is None:
+        raw = src.read(band, window=Window(col_off, row_off, cols, rows))
+    block = nodata_to_nan(raw, src.nodatavals[band - 1])
+    if not cache:
+        return block
+
+    with block_cache['lock']:
+        if key not in blocks:
+            blocks[key] = block
+            block_cache['nbytes'] += block.nbytes
+            trim_cache()
+    return block
+
+
+# Window of a band as float64 with NaN nodata; the parts outside the raster are NaN as well
+def read_window(src, window, band=1, cache=True):
+    window = Window(*window.flatten()).round_offsets().round_lengths()
+    row_off, col_off, height, width = int(window.row_off), int(window.col_off), int(window.height), int(window.width)
+    values = np.full((height, width), np.nan)
+
+    block_height, block_width = src.block_shapes[band - 1]
+    row_start, row_end = max(row_off, 0), min(row_off + height, src.height)
+    col_start, col_end = max(col_off, 0), min(col_off + width, src.width)
+    if row_start >= row_end or col_start >= col_end:
+        return values
+
+    for block_row in range(row_start // block_height, (row_end - 1) // block_height + 1):
+        for block_col in range(col_start // block_width, (col_end - 1) // block_width + 1):
+            block = read_block(src, block_row, block_col, band, cache)
+            top, left = block_row * block_height, block_col * block_width
+            r0, r1 = max(row_start, top), min(row_end, top + block.shape[0])
+            c0, c1 = max(col_start, left), min(col_end, left + block.shape[1])
+            values[r0 - row_off:r1 - row_off, c0 - col_off:c1 - col_off] = block[r0 - top:r1 - top, c0 - left:c1 - left]
+    return values
+
+
+# A whole band; it is already all in memory, so by default its blocks are not kept in the cache as well
+def read_band(src, band=1, cache=False):
+    return read_window(src, Window(0, 0, src.width, src.height), band, cache)
+
+
+# Values of individual cells (row/column arrays); only the blocks the cells fall in are read
+def read_cells(src, rows, cols, band=1, cache=True):
+    rows, cols = np.asarray(rows), np.asarray(cols)
+    values = np.full(len(rows), np.nan)
+    inside = np.flatnonzero((rows >= 0) & (rows < src.height) & (cols >= 0) & (cols < src.width))
+    if len(inside) == 0:
+        return values
+
+    block_height, block_width = src.block_shapes[band - 1]
+    block_rows, block_cols = rows[inside] // block_height, cols[inside] // block_width
+    keys = block_rows * ((src.width + block_width - 1) // block_width) + block_cols
+    order = np.argsort(keys, kind='stable')
+    for group in np.split(order, np.flatnonzero(np.diff(keys[order])) + 1):
+        block_row, block_col = block_rows[group[0]], block_cols[group[0]]
+        block = read_block(src, block_row, block_col, band, cache)
+        cells = inside[group]
+        values[cells] = block[rows[cells] - block_row * block_height, cols[cells] - block_col * block_width]
+    return values
@@ -0,0 +1,74 @@
+# Checks that raster_io reads the same values as rasterio, from local files and from GDAL virtual paths
+import zipfile
+import numpy as np
+import pytest
+import rasterio
+from rasterio.io import MemoryFile
+from rasterio.transform import from_origin
+from rasterio.windows import Window
+
+import raster_io
+
+
+def make_values():
+    values = np.arange(60 * 50, dtype=np.float32).reshape(60, 50)
+    values[3, 4] = raster_io.NODATA_SENTINEL
+    values[10, 20] = np.nan
+    return values
+
+
+def expected_values(values):
+    expected = values.astype(np.float64)
+    expected[expected == raster_io.NODATA_SENTINEL] = np.nan
+    return expected
+
+
+def write_geotiff(path, values, **options):
+    with rasterio.open(path, 'w', driver='GTiff', height=values.shape[0], width=values.shape[1], count=1,
+                       dtype=values.dtype, crs=raster_io.DEFAULT_CRS, transform=from_origin(0, 60, 1, 1),
+                       **options) as dst:
+        dst.write(values, 1)
+
+
+def check_reads(src, values):
+    expected = expected_values(values)
+    raster_io.clear_cache()
+    np.testing.assert_array_equal(raster_io.read_band(src), expected)
+
+    rows, cols = np.array([0, 3, 10, 59, 70]), np.array([0, 4, 20, 49, 0])
+    cells = raster_io.read_cells(src, rows, cols)
+    np.testing.assert_array_equal(cells[:4], expected[rows[:4], cols[:4]])
+    assert np.isnan(cells[4])
+
+    window = raster_io.read_window(src, Window(-5, 40, 20, 30))
+    np.testing.assert_array_equal(window[:20, 5:], expected[40:60, :15])
+    assert np.isnan(window[20:]).all() and np.isnan(window[:, :5]).all()
+
+
+@pytest.mark.parametrize('options', [{}, {'tiled': True, 'blockxsize': 16, 'blockysize': 16}, {'compress': 'lzw'}])
+def test_local_file(tmp_path, options):
+    values = make_values()
+    path = str(tmp_path / 'r0.tif')
+    write_geotiff(path, values, **options)
+    with rasterio.open(path) as src:
+        check_reads(src, values)
+
+
+def test_zipped_file(tmp_path):
+    values = make_values()
+    path = tmp_path / 'r0.tif'
+    write_geotiff(str(path), values)
+    with zipfile.ZipFile(tmp_path / 'z.zip', 'w') as archive:
+        archive.write(path, 'r0.tif')
+
+    with rasterio.open(f"/vsizip/{tmp_path / 'z.zip'}/r0.tif") as src:
+        check_reads(src, values)
+
+
+def test_memory_file(tmp_path):
+    values = make_values()
+    path = tmp_path / 'r0.tif'
+    write_geotiff(str(path), values)
+
+    with MemoryFile(path.read_bytes()) as memory_file, memory_file.open() as src:
+        check_reads(src, values)